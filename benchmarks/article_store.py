@@ -0,0 +1,61 @@
+"""Memory footprint of ArticleStore compared to a dict of ArticleInfo.
+
+Builds the same synthetic overview data both ways and reports the memory
+allocated by each, as measured by tracemalloc.
+
+    python3 benchmarks/article_store.py [--articles N]
+"""
+import argparse
+import datetime
+import gc
+import tracemalloc
+import typing
+
+from nntpserver import ArticleInfo, ArticleStore
+
+AUTHORS = [f"user{i} <user{i}@example.com>" for i in range(500)]
+
+
+def synthetic(count: int) -> typing.Iterator[ArticleInfo]:
+    epoch = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    for n in range(1, count + 1):
+        yield ArticleInfo(
+            n,
+            f"Re: thread {n // 10}",
+            AUTHORS[n % len(AUTHORS)],
+            epoch + datetime.timedelta(seconds=n * 37),
+            f"<{n}@example.com>",
+            f"<{n - 1}@example.com>" if n % 10 else "",
+            1000 + n % 4000,
+            20 + n % 80,
+            {"Newsgroups": "example.test"},
+        )
+
+
+def measure(build: typing.Callable[[], object]) -> typing.Tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--articles", type=int, default=200_000)
+    args = parser.parse_args()
+
+    _, naive = measure(lambda: {a.number: a for a in synthetic(args.articles)})
+    store, compact = measure(lambda: ArticleStore(synthetic(args.articles)))
+    assert len(typing.cast(ArticleStore, store)) == args.articles
+    for name, size in (("dict of ArticleInfo", naive), ("ArticleStore", compact)):
+        print(
+            f"{name:>20}: {size / 2**20:8.1f} MiB "
+            f"({size / args.articles:6.1f} bytes/article)"
+        )
+
+
+if __name__ == "__main__":
+    main()
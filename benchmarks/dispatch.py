@@ -0,0 +1,125 @@
+"""Micro-benchmark of per-command dispatch overhead in NNTPConnectionHandler.
+
+Every command method is replaced by a no-op, so the timings only include
+parsing the verb and finding the handler. For comparison the same command
+lines are run through a replica of the former if/elif startswith chain.
+
+    python3 benchmarks/dispatch.py [--number N]
+"""
+import argparse
+import timeit
+import typing
+
+from nntpserver import NNTPConnectionHandler
+
+COMMAND_LINES = [
+    "ARTICLE 3000000",
+    "HEAD <12345@example.com>",
+    "STAT 3000001",
+    "XOVER 1-100",
+    "HDR Subject 1-100",
+    "GROUP comp.lang.python",
+    "LIST ACTIVE comp.*",
+    "NEXT",
+    "DATE",
+    "CAPABILITIES",
+]
+
+
+class NoopHandler(NNTPConnectionHandler):
+    metrics = None
+
+    def __init__(self) -> None:
+        self._init_state()
+        self.server = typing.cast(typing.Any, self)
+
+    def _noop(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        pass
+
+
+for _name in set(NNTPConnectionHandler.commands.values()):
+    setattr(NoopHandler, typing.cast(str, _name), NoopHandler._noop)
+
+
+def legacy_dispatch(handler: NoopHandler, data: str) -> None:
+    data_caseless = data.casefold()
+    if data_caseless == "capabilities":
+        handler._noop()
+    elif data_caseless.startswith("authinfo"):
+        handler._noop()
+    elif data_caseless == "post":
+        handler._noop()
+    elif data_caseless.startswith("group"):
+        handler._noop()
+    elif data_caseless.startswith("over") or data_caseless.startswith("xover"):
+        handler._noop()
+    elif data_caseless.startswith("hdr") or data_caseless.startswith("xhdr"):
+        handler._noop()
+    elif data_caseless.startswith("stat"):
+        handler._noop()
+    elif data_caseless.startswith("article"):
+        handler._noop()
+    elif data_caseless.startswith("body"):
+        handler._noop()
+    elif data_caseless.startswith("head"):
+        handler._noop()
+    elif data_caseless == "next":
+        handler._noop()
+    elif data_caseless == "last":
+        handler._noop()
+    elif data_caseless == "help":
+        handler._noop()
+    elif data_caseless.startswith("listgroup"):
+        handler._noop()
+    elif (
+        data_caseless == "list newsgroups"
+        or data_caseless == "list"
+        or data_caseless.startswith("list active")
+    ):
+        handler._noop()
+    elif data_caseless == "list subscriptions":
+        handler._noop()
+    elif data_caseless == "mode reader":
+        handler._noop()
+    elif data_caseless == "list overview.fmt":
+        handler._noop()
+    elif data_caseless == "date":
+        handler._noop()
+    elif data_caseless.startswith("newnews"):
+        handler._noop()
+    elif data_caseless.startswith("newgroups"):
+        handler._noop()
+    elif data_caseless == "quit":
+        handler._noop()
+    else:
+        handler._noop()
+    handler.command_history.append(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+
+    handler = NoopHandler()
+
+    def table() -> None:
+        for line in COMMAND_LINES:
+            handler.data = line
+            handler.process_command()
+        handler.command_history.clear()
+
+    def legacy() -> None:
+        for line in COMMAND_LINES:
+            legacy_dispatch(handler, line)
+        handler.command_history.clear()
+
+    rounds = max(1, args.number // len(COMMAND_LINES))
+    for name, func in (("table", table), ("if/elif chain", legacy)):
+        elapsed = min(timeit.repeat(func, number=rounds, repeat=5))
+        per_command = elapsed / (rounds * len(COMMAND_LINES)) * 1e9
+        print(f"{name:>14}: {per_command:7.1f} ns/command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Rate of TLS connections accepted while other clients stall their handshake.
+
+A number of clients connect and never send a ClientHello, then new clients
+connect, complete the handshake and read the greeting one after another.
+Servers that do the handshake in the listener thread (as NNTPServer did with
+ssl.wrap_socket() in get_request) only accept the next connection once the
+stalled handshake times out; the current servers do it per connection.
+
+    python3 benchmarks/tls_accept.py [--connections N] [--stalled N]
+        [--certfile FILE --keyfile FILE]
+
+Without --certfile, a self-signed certificate is created with the openssl
+command.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import typing
+
+from nntpserver import (
+    Article,
+    ArticleInfo,
+    AsyncNNTPServer,
+    NNTPArticleNotFound,
+    NNTPBackend,
+    NNTPConnectionHandler,
+    NNTPGroup,
+    NNTPServer,
+    PooledNNTPConnectionHandler,
+    PooledNNTPServer,
+)
+
+
+class EmptyBackend(NNTPBackend):
+    def refresh(self) -> None:
+        pass
+
+    @property
+    def groups(self) -> typing.Dict[str, NNTPGroup]:
+        return {}
+
+    @property
+    def articles(self) -> typing.Dict[typing.Union[int, str], ArticleInfo]:
+        return {}
+
+    def article(self, key: typing.Union[str, int]) -> Article:
+        raise NNTPArticleNotFound(key)
+
+
+class ThreadedServer(EmptyBackend, NNTPServer):
+    pass
+
+
+class PooledServer(EmptyBackend, PooledNNTPServer):
+    pass
+
+
+class AsyncServer(EmptyBackend, AsyncNNTPServer):
+    pass
+
+
+class ListenerHandshakeServer(ThreadedServer):
+    """Does the handshake in get_request(), like NNTPServer used to (but
+    with handshake_timeout, so that a stalled client cannot block it
+    forever)."""
+
+    def get_request(self) -> typing.Tuple[typing.Any, typing.Tuple[str, int]]:
+        newsocket, fromaddr = self.socket.accept()
+        newsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        newsocket.settimeout(self.handshake_timeout)
+        context = typing.cast(ssl.SSLContext, self.ssl_context)
+        try:
+            return context.wrap_socket(newsocket, server_side=True), fromaddr
+        except OSError:
+            newsocket.close()
+            raise
+
+
+def self_signed(directory: str) -> typing.Tuple[str, str]:
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def start(
+    server_class: typing.Type[EmptyBackend], kwargs: typing.Dict[str, typing.Any]
+) -> typing.Tuple[typing.Tuple[str, int], typing.Callable[[], None]]:
+    """Serve in a background thread; returns the address and a stop function."""
+    if issubclass(server_class, AsyncNNTPServer):
+        server = server_class(("127.0.0.1", 0), **kwargs)
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            loop.run_until_complete(server.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+
+        def stop() -> None:
+            loop.call_soon_threadsafe(server.close)
+            loop.call_soon_threadsafe(loop.stop)
+
+        return server.server_address, stop
+    handler: typing.Type[NNTPConnectionHandler] = NNTPConnectionHandler
+    if issubclass(server_class, PooledNNTPServer):
+        handler = PooledNNTPConnectionHandler
+    sync_server = typing.cast(
+        NNTPServer, server_class(("127.0.0.1", 0), handler, **kwargs)
+    )
+    threading.Thread(target=sync_server.serve_forever, daemon=True).start()
+
+    def stop_sync() -> None:
+        sync_server.shutdown()
+        sync_server.server_close()
+
+    return sync_server.server_address, stop_sync
+
+
+def measure(
+    address: typing.Tuple[str, int], connections: int, stalled: int
+) -> typing.Tuple[float, float]:
+    """Return connections per second and the slowest connection time."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    idle = [socket.create_connection(address) for _ in range(stalled)]
+    slowest = 0.0
+    start = time.perf_counter()
+    for _ in range(connections):
+        begin = time.perf_counter()
+        with context.wrap_socket(socket.create_connection(address)) as conn:
+            conn.recv(512)
+        slowest = max(slowest, time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    for sock in idle:
+        sock.close()
+    return connections / elapsed, slowest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--stalled", type=int, default=4)
+    parser.add_argument("--handshake-timeout", type=float, default=0.5)
+    parser.add_argument("--certfile", type=str, default=None)
+    parser.add_argument("--keyfile", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = args.certfile, args.keyfile
+        if certfile is None:
+            certfile, keyfile = self_signed(directory)
+        kwargs = {"use_ssl": True, "certfile": certfile, "keyfile": keyfile}
+        for name, server_class in (
+            ("listener handshake", ListenerHandshakeServer),
+            ("NNTPServer", ThreadedServer),
+            ("PooledNNTPServer", PooledServer),
+            ("AsyncNNTPServer", AsyncServer),
+        ):
+            server_class.handshake_timeout = args.handshake_timeout
+            address, stop = start(server_class, kwargs)
+            try:
+                rate, slowest = measure(address, args.connections, args.stalled)
+            finally:
+                stop()
+            print(
+                f"{name:>18}: {rate:8.1f} connections/s, "
+                f"slowest {slowest * 1e3:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 import typing
 import datetime
 import argparse
+import logging
 import threading
 import collections.abc
 
 from nntpserver import (
+    NNTPBackend,
     NNTPServer,
+    AsyncNNTPServer,
+    PooledNNTPServer,
+    PooledNNTPConnectionHandler,
     NNTPGroup,
     NNTPConnectionHandler,
     NNTPAuthSetting,
@@ -35,8 +40,8 @@ EXAMPLE_ARTICLE = Article(
 class Articles(NNTPGroup):
     _name: str = "example.all"
 
-    def __init__(self, server: "ExampleNNTPServer") -> None:
-        self.server: "ExampleNNTPServer" = server
+    def __init__(self, server: "ExampleBackend") -> None:
+        self.server: "ExampleBackend" = server
 
     @property
     def name(self) -> str:
@@ -71,7 +76,7 @@ class Articles(NNTPGroup):
         return False
 
 
-class ExampleNNTPServer(NNTPServer, collections.abc.Mapping):
+class ExampleBackend(NNTPBackend, collections.abc.Mapping):
     def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
         self.all: Articles = Articles(self)
         self._groups: typing.Dict[str, NNTPGroup] = {self.all.name: self.all}
@@ -140,14 +145,30 @@ class ExampleNNTPServer(NNTPServer, collections.abc.Mapping):
         return True
 
 
+class ExampleNNTPServer(ExampleBackend, NNTPServer):
+    pass
+
+
+class AsyncExampleNNTPServer(ExampleBackend, AsyncNNTPServer):
+    pass
+
+
+class PooledExampleNNTPServer(ExampleBackend, PooledNNTPServer):
+    pass
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     parser = argparse.ArgumentParser(description="Example NNTP server")
     parser.add_argument("--port", type=int, default=9999)
     parser.add_argument("--host", type=str, default="localhost")
     parser.add_argument("--use-ssl", action="store_true", default=False)
+    parser.add_argument("--starttls", action="store_true", default=False)
     parser.add_argument("--connect-with-nntplib", action="store_true", default=False)
     parser.add_argument("--certfile", type=str, default=None)
     parser.add_argument("--keyfile", type=str, default=None)
+    parser.add_argument("--asyncio", action="store_true", default=False)
+    parser.add_argument("--pooled", action="store_true", default=False)
 
     args = parser.parse_args()
     host = args.host
@@ -156,15 +177,32 @@ if __name__ == "__main__":
         server_kwargs["use_ssl"] = True
         server_kwargs["certfile"] = args.certfile
         server_kwargs["keyfile"] = args.keyfile
+    elif args.starttls:
+        server_kwargs["starttls"] = True
+        server_kwargs["certfile"] = args.certfile
+        server_kwargs["keyfile"] = args.keyfile
     server_kwargs["auth"] = NNTPAuthSetting.NOAUTH
     server_kwargs["can_post"] = NNTPPostSetting.NOPOST
 
-    ExampleNNTPServer.allow_reuse_address = True
+    if args.asyncio:
+        async_server = AsyncExampleNNTPServer((args.host, args.port), **server_kwargs)
+        print(f"Listening on {args.host}:{args.port} (asyncio)")
+        try:
+            async_server.run()
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit(0)
+
+    if args.pooled:
+        server_class: typing.Type[NNTPServer] = PooledExampleNNTPServer
+        handler_class: typing.Type[NNTPConnectionHandler] = PooledNNTPConnectionHandler
+    else:
+        server_class = ExampleNNTPServer
+        handler_class = NNTPConnectionHandler
+    server_class.allow_reuse_address = True
 
     # Create the server, binding to localhost on port 9999
-    with ExampleNNTPServer(
-        (args.host, args.port), NNTPConnectionHandler, **server_kwargs
-    ) as server:
+    with server_class((args.host, args.port), handler_class, **server_kwargs) as server:
         print(f"Listening on {args.host}:{args.port}")
         server.allow_reuse_address = True
         # Activate the server; this will keep running until you
@@ -1,11 +1,13 @@
 import typing
 import datetime
 import argparse
+import logging
 import threading
 import collections.abc
 import http.client
 import json
 import re
+import signal
 import sqlite3
 
 
@@ -19,8 +21,15 @@ from nntpserver import (
     NNTPServerError,
     Article,
     ArticleInfo,
+    ArticleNumberIndex,
+    ArticleStore,
+    GroupWatermarks,
+    LazyArticleNumberIndex,
+    MessageIdIndex,
 )
 
+logger = logging.getLogger("hnnntp")
+
 MSG_ID_RE = re.compile(r"<(?P<id>\d+)@news.ycombinator.com>")
 
 
@@ -40,15 +49,19 @@ class Articles(NNTPGroup):
 
     @property
     def number(self) -> int:
-        return self.server.count
+        return self.server.index.count
 
     @property
     def high(self) -> int:
-        return self.server.high
+        return self.server.index.high
 
     @property
     def low(self) -> int:
-        return self.server.low
+        return self.server.index.low
+
+    @property
+    def index(self) -> ArticleNumberIndex:
+        return self.server.index
 
     @property
     def articles(self) -> typing.Dict[typing.Union[int, str], ArticleInfo]:
@@ -80,17 +93,26 @@ def get_to_json(url) -> typing.Any:
 
 
 class HNNNTPServer(NNTPServer, collections.abc.Mapping):
+    # Poll the HN API once a minute from a background thread instead of on
+    # every command.
+    refresh_interval = 60.0
+    refresh_in_background = True
+
     def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
         self.all: Articles = Articles(self)
         self._groups: typing.Dict[str, NNTPGroup] = {self.all.name: self.all}
-        self.count: int = 0
-        self.high: int = 0
-        self.low: int = 0
-        self.article_index: typing.Dict[int, typing.Optional[Article]] = {}
-        self.build_index()
+        # Story ids, loaded by warm_up(). Until then the group watermarks come
+        # from a single aggregate query, so startup does not depend on the
+        # size of the cache.
+        self.index: LazyArticleNumberIndex = self.build_index()
+        # Overview data of stories, materialized on first access
+        self.store: ArticleStore = ArticleStore()
+        # Incremented when the watermarks of hn.all change, see active_version()
+        self.groups_version = 0
+        self._lock = threading.Lock()
         super().__init__(*args, **kwargs)
 
-    def row_to_article(self, story) -> None:
+    def row_to_article(self, story) -> Article:
         i = story["id"]
         body = story["body"]
         info = ArticleInfo(
@@ -99,14 +121,13 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
             f"{story['by']}@news.ycombinator.com",
             datetime.datetime.fromtimestamp(story["time"], tz=datetime.timezone.utc),
             f"<{i}@news.ycombinator.com>",
-            f"<{story['parent']}@news.ycombinator.com>" if "parent" in story else "",
+            f"<{story['parent']}@news.ycombinator.com>" if story["parent"] else "",
             len(body),
             len(body.split()),
             {"Permalink": f"https://news.ycombinator.com/item?id={i}"},
         )
-
-        self.article_index[i] = Article(info, body)
-        return
+        self.store.add(info)
+        return Article(info, body)
 
     def get_conn(self):
         conn = sqlite3.connect("hn_cache.db", isolation_level=None)
@@ -124,35 +145,46 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
         )
         return conn
 
-    def build_index(self):
-        self.count: int = 0
-        self.high: int = 0
-        self.low: int = 0
-        self.article_index: typing.Dict[int, typing.Optional[Article]] = {}
+    def build_index(self) -> LazyArticleNumberIndex:
         conn = self.get_conn()
-        cur = conn.cursor()
-        for row in cur.execute("SELECT * FROM articles ORDER BY id"):
-            self.row_to_article(row)
-
-        self.refresh()
+        low, high, count = conn.execute(
+            "SELECT MIN(id), MAX(id), COUNT(*) FROM articles"
+        ).fetchone()
+        conn.close()
+        logger.info("%d cached stories", count)
+        return LazyArticleNumberIndex(GroupWatermarks(low or 0, high or 0, count))
 
-        self.count = len(self.article_index)
-        if self.count == 0:
-            self.high = 0
-            self.low = 0
-            return
-        print("count", self.count)
-        self.high = max(self.article_index.keys())
-        self.low = min(self.article_index.keys())
+    def warm_up(self) -> None:
+        conn = self.get_conn()
+        rows = conn.execute("SELECT id FROM articles ORDER BY id")
+        self.index.load(row[0] for row in rows)
+        conn.close()
+        message_ids = MessageIdIndex()
+        with self._lock:
+            for i in self.index:
+                message_ids.add(f"<{i}@news.ycombinator.com>", self.all.name, i)
+            self.message_ids = message_ids
+            self.groups_version += 1
+        logger.info("Loaded %d story ids", self.index.count)
 
     def refresh(self) -> None:
         data = get_to_json("/v0/topstories.json")
-        for i in data[:40]:
-            if i not in self.article_index:
-                self.high = max(self.high, i)
-                self.low = min(self.low, i)
-                self.count += 1
-                self.article_index[i] = None
+        with self._lock:
+            for i in data[:40]:
+                # Membership tests wait for warm_up() to load the index, and
+                # add() does not, so new ids are told apart by the count.
+                count = self.index.count
+                self.index.add(i)
+                if self.index.count != count:
+                    self.groups_version += 1
+                    if self.message_ids is not None:
+                        self.message_ids.add(
+                            f"<{i}@news.ycombinator.com>", self.all.name, i
+                        )
+
+    def active_version(self) -> int:
+        # LIST is answered from a cached active file until this changes.
+        return self.groups_version
 
     @property
     def groups(self) -> typing.Dict[str, NNTPGroup]:
@@ -162,6 +194,12 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
     def articles(self) -> typing.Dict[typing.Union[int, str], ArticleInfo]:
         return self
 
+    def iter_range(
+        self, group: NNTPGroup, low: int, high: int
+    ) -> typing.Iterator[ArticleInfo]:
+        for i in self.index.range(low, high):
+            yield self.info(i)
+
     def newnews(
         self, wildmat: str, date: datetime.datetime
     ) -> typing.Optional[typing.Iterator[ArticleInfo]]:
@@ -173,13 +211,22 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
             yield self[row["id"]]
         return None
 
+    def info(self, i: int) -> ArticleInfo:
+        try:
+            return self.store[i]
+        except NNTPArticleNotFound:
+            return self.warm(i).info
+
     def warm(self, i) -> Article:
-        if self.article_index[i]:
-            return typing.cast(Article, self.article_index[i])
-        print(f"Getting story {i}")
+        conn = self.get_conn()
+        row = conn.execute("SELECT * FROM articles WHERE id = ?", (i,)).fetchone()
+        conn.close()
+        if row is not None:
+            return self.row_to_article(row)
+        logger.info("Getting story %s", i)
 
         story = get_to_json(f"/v0/item/{i}.json?print=pretty")
-        print(f"for {i} I got ", story)
+        logger.debug("For %s I got %s", i, story)
         if "text" in story:
             body = story["text"]
         elif "url" in story:
@@ -197,11 +244,10 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
             len(body.split()),
             {"Permalink": f"https://news.ycombinator.com/item?id={i}"},
         )
-        self.article_index[i] = Article(info, body)
-        print(f"Got {self.article_index[i]}")
+        self.store.add(info)
+        logger.debug("Got %s", info)
         conn = self.get_conn()
         cursor = conn.cursor()
-        print("INSERTING : ")
         cursor.execute(
             """INSERT OR IGNORE INTO articles(id, title, by, time,parent, kids, body) VALUES
     (?, ?, ?, ?,?, ?, ?)""",
@@ -217,7 +263,7 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
         )
         conn.commit()
         conn.close()
-        return typing.cast(Article, self.article_index[i])
+        return Article(info, body)
 
     def __getitem__(self, key: typing.Union[str, int]) -> ArticleInfo:
         if isinstance(key, str):
@@ -232,17 +278,17 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
             except (KeyError, AttributeError, ValueError):
                 raise NNTPArticleNotFound(key)
         try:
-            if key not in self.article_index:
+            if key not in self.index:
                 raise NNTPArticleNotFound(key)
-            return self.warm(key).info
+            return self.info(key)
         except KeyError:
             raise NNTPArticleNotFound(key)
 
     def __iter__(self) -> typing.Iterator[typing.Union[str, int]]:
-        return (k for k in self.article_index)
+        return iter(self.index)
 
     def __len__(self) -> int:
-        return self.count
+        return self.index.count
 
     def article(self, key: typing.Union[str, int]) -> Article:
         if isinstance(key, str):
@@ -257,7 +303,7 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
             except (KeyError, AttributeError, ValueError):
                 raise NNTPArticleNotFound(key)
         try:
-            if key not in self.article_index:
+            if key not in self.index:
                 raise NNTPArticleNotFound(key)
             return self.warm(key)
         except KeyError:
@@ -273,6 +319,7 @@ class HNNNTPServer(NNTPServer, collections.abc.Mapping):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     parser = argparse.ArgumentParser(description="HN NNTP server")
     parser.add_argument("--port", type=int, default=9999)
     parser.add_argument("--host", type=str, default="localhost")
@@ -299,6 +346,12 @@ if __name__ == "__main__":
     ) as server:
         print(f"Listening on {args.host}:{args.port}")
         server.allow_reuse_address = True
+        if args.use_ssl:
+            # serve_forever() runs in another thread, so it cannot install
+            # the SIGHUP handler itself.
+            signal.signal(
+                signal.SIGHUP, lambda signum, frame: server.reload_ssl_context()
+            )
         # Activate the server; this will keep running until you
         # interrupt the program with Ctrl-C
         server_thread = threading.Thread(target=server.serve_forever)
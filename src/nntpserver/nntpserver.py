@@ -1,10 +1,30 @@
 import abc
+import array
+import asyncio
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import inspect
+import socket
 import socketserver
 import typing
 import datetime
 import itertools
+import logging
+import logging.handlers
+import mmap
+import os
 import enum
+import functools
+import gc
+import queue
 import re
+import selectors
+import signal
+import sys
+import threading
+import time
 
 
 class NNTPAuthSetting(enum.Flag):
@@ -51,6 +71,10 @@ class NNTPArticleNotFound(NNTPServerError):
     DEFAULT = "No article with that number"
 
 
+class NNTPTimeoutError(NNTPServerError):
+    DEFAULT = "Timed out waiting for the client"
+
+
 try:
     import ssl
 except ImportError:
@@ -58,6 +82,13 @@ except ImportError:
 else:
     _have_ssl = True
 
+try:
+    import fcntl
+except ImportError:
+    _have_fcntl = False
+else:
+    _have_fcntl = True
+
 # from email.header import decode_header as _email_decode_header
 import email.utils
 
@@ -65,8 +96,30 @@ import email.utils
 NNTP_PORT = 119
 NNTP_SSL_PORT = 563
 _MAXLINE = 2048
+# Number of bytes requested per read from a client connection
+_READ_SIZE = 64 * 1024
+# Flush the per-connection output buffer once it holds this many bytes
+_WRITE_HIGH_WATER = 64 * 1024
 
 _CRLF = b"\r\n"
+# The terminating line of a multi-line data block sent by a client
+_BLOCK_END = re.compile(rb"^\.\r?\n", re.MULTILINE)
+
+# Connection, protocol trace (DEBUG) and background task messages
+_logger = logging.getLogger("nntpserver")
+
+# OverviewFile.header() column of the overview fields, by HDR field name
+_OVERVIEW_COLUMNS = {
+    "subject": 1,
+    "from": 2,
+    "date": 3,
+    "message-id": 4,
+    "references": 5,
+    ":bytes": 6,
+    ":lines": 7,
+}
+# Size of an OverviewFile index record: article number and end offset
+_OVERVIEW_RECORD_SIZE = 16
 
 # Default decoded value for LIST OVERVIEW.FMT if not supported
 _DEFAULT_OVERVIEW_FMT = [
@@ -80,6 +133,28 @@ _DEFAULT_OVERVIEW_FMT = [
 ]
 
 
+def log_to_queue(
+    *handlers: logging.Handler, level: typing.Optional[int] = None
+) -> logging.handlers.QueueListener:
+    """Send the records of the "nntpserver" logger through a queue to
+    handlers (by default a StreamHandler on stderr), which are run by a
+    background thread, so that connection threads never wait on I/O or
+    handler locks to log.
+
+    Returns the started QueueListener; call its stop() method on shutdown to
+    flush pending records."""
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, *(handlers or (logging.StreamHandler(),)), respect_handler_level=True
+    )
+    _logger.addHandler(logging.handlers.QueueHandler(records))
+    _logger.propagate = False
+    if level is not None:
+        _logger.setLevel(level)
+    listener.start()
+    return listener
+
+
 def parse_datetime(
     date_str: str, time_str: typing.Optional[str] = None
 ) -> datetime.datetime:
@@ -155,6 +230,149 @@ def parse_range(s) -> typing.Optional[typing.Tuple[int, typing.Optional[int]]]:
         return None
 
 
+# Maximum length of a wildmat argument
+_MAX_WILDMAT = 512
+
+
+def _pattern_regex(pattern: str, groups: typing.Iterator[int]) -> str:
+    """Return a regular expression for one wildmat pattern that matches in
+    time linear in the length of the name.
+
+    The pattern is split into the literal segments between "*"s. Matching
+    each segment at its first occurrence after the previous one is correct
+    for globs, so the segments are matched without backtracking, emulating
+    atomic groups with a lookahead and a backreference as fnmatch does."""
+
+    def segment(text: str) -> str:
+        return "".join("." if c == "?" else re.escape(c) for c in text)
+
+    first, *rest = pattern.split("*")
+    if not rest:
+        return segment(first)
+    *middle, last = rest
+    regex = [segment(first)]
+    for text in middle:
+        if text:
+            group = f"w{next(groups)}"
+            regex.append(f"(?=(?P<{group}>.*?{segment(text)}))(?P={group})")
+    regex.append(f".*{segment(last)}")
+    return "".join(regex)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_wildmat(wildmat: str) -> typing.Callable[[str], typing.Any]:
+    """Compile an RFC 3977 wildmat into a function that returns a true value
+    for the newsgroup names it matches.
+
+    A wildmat is a comma separated list of patterns in which "*" matches any
+    sequence of characters and "?" a single character. Patterns prefixed
+    with "!" exclude the names they match; of several matching patterns the
+    last one decides. Compiled wildmats are cached. Raises ValueError for
+    wildmats longer than 512 characters.
+    """
+    if len(wildmat) > _MAX_WILDMAT:
+        raise ValueError(f"Wildmat longer than {_MAX_WILDMAT} characters")
+    groups = itertools.count()
+    patterns = []
+    for pattern in wildmat.split(","):
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        patterns.append((negated, re.sub(r"\*+", "*", pattern)))
+    # A name matches a pattern if no later negated pattern matches it too, so
+    # the whole wildmat becomes one regular expression. Negated patterns are
+    # converted once per use, as group names must be unique.
+    alternatives = []
+    for i, (negated, pattern) in enumerate(patterns):
+        if negated:
+            continue
+        regex = _pattern_regex(pattern, groups)
+        later = [_pattern_regex(p, groups) for n, p in patterns[i + 1 :] if n]
+        if later:
+            regex = "(?!(?:%s)\\Z)%s" % ("|".join(later), regex)
+        alternatives.append(regex)
+    if not alternatives:
+        return re.compile("(?!)").match
+    return re.compile("(?:%s)\\Z" % "|".join(alternatives), re.DOTALL).match
+
+
+def _iter_lines(text: str) -> typing.Iterator[str]:
+    """Lazily yield the same items as text.split("\\n")."""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def _dot_stuff(line: str) -> str:
+    line = line.strip()
+    if line.startswith("."):
+        return "." + line
+    return line
+
+
+def _encode_line(line: str) -> bytes:
+    """Return the wire form of a line of a multi-line data block."""
+    return _dot_stuff(line).encode("utf-8") + _CRLF
+
+
+_K = typing.TypeVar("_K")
+_V = typing.TypeVar("_V")
+
+
+class LRUCache(typing.Generic[_K, _V]):
+    """A thread-safe mapping that keeps at most maxsize recently used items.
+
+    If sizeof is given, maxsize bounds the sum of sizeof(value) instead of the
+    number of items."""
+
+    def __init__(
+        self, maxsize: int, sizeof: typing.Optional[typing.Callable[[_V], int]] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self._data: "collections.OrderedDict[_K, _V]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weigh(self, value: _V) -> int:
+        return 1 if self.sizeof is None else self.sizeof(value)
+
+    def get(self, key: _K) -> typing.Optional[_V]:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def put(self, key: _K, value: _V) -> None:
+        weight = self._weigh(value)
+        if weight > self.maxsize:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= self._weigh(old)
+            self._data[key] = value
+            self.size += weight
+            while self.size > self.maxsize:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= self._weigh(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
 class ArticleInfo(typing.NamedTuple):
     number: int
     subject: str
@@ -185,6 +403,91 @@ class ArticleInfo(typing.NamedTuple):
 class Article(typing.NamedTuple):
     info: ArticleInfo
     body: str
+    # The body in wire form as returned by encode_body(), if precomputed
+    wire_body: typing.Optional[bytes] = None
+
+    def with_wire_body(self) -> "Article":
+        """Return a copy of the article carrying its encoded body."""
+        if self.wire_body is not None:
+            return self
+        return self._replace(wire_body=encode_body(self.body))
+
+
+def encode_body(body: str) -> bytes:
+    """Return body dot-stuffed with CRLF line endings, as sent by ARTICLE and
+    BODY before the terminating "." line."""
+    return b"".join(map(_encode_line, _iter_lines(body)))
+
+
+# ArticleInfo attributes of the HDR fields other than Date and extra headers
+_HEADER_ATTRIBUTES = {
+    "subject": "subject",
+    "from": "from_",
+    "message-id": "message_id",
+    "references": "references",
+    ":bytes": "bytes",
+    ":lines": "lines",
+}
+
+
+def _clean_header(value: str) -> str:
+    """Unfold a header value and replace tabs, as HDR and OVER send it."""
+    return value.replace("\r\n", "").replace("\t", " ")
+
+
+def _encode_overview(info: ArticleInfo) -> bytes:
+    """Return the CRLF terminated overview line of info, with its fields
+    unfolded and tabs replaced so that they can be split on tabs."""
+    fields = [
+        str(info.number),
+        info.subject,
+        info.from_,
+        email.utils.format_datetime(info.date),
+        info.message_id,
+        info.references,
+        str(info.bytes),
+        str(info.lines),
+    ]
+    fields.extend(f"{k}: {v}" for k, v in info.headers.items())
+    return _encode_line("\t".join(map(_clean_header, fields)))
+
+
+@functools.lru_cache(maxsize=1024)
+def _casefolded_keys(keys: typing.Tuple[str, ...]) -> typing.Dict[str, int]:
+    """Map the casefolded header names in keys to their first position."""
+    positions: typing.Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        positions.setdefault(key.casefold(), i)
+    return positions
+
+
+@functools.lru_cache(maxsize=256)
+def header_accessor(field: str) -> typing.Callable[[ArticleInfo], str]:
+    """Return a function that extracts the HDR value of field (a header
+    name or a metadata item such as ":lines") from an ArticleInfo.
+
+    The field name is resolved once, so getting it from many articles does
+    not compare names per article. Extra headers are found through a map of
+    casefolded names that is shared by all articles with the same header
+    names."""
+    name = field.casefold()
+    if name == "date":
+        return lambda info: email.utils.format_datetime(info.date)
+    attribute = _HEADER_ATTRIBUTES.get(name)
+    if attribute in ("bytes", "lines"):
+        return lambda info: str(getattr(info, attribute))
+    if attribute is not None:
+        return lambda info: _clean_header(getattr(info, attribute))
+
+    def header(info: ArticleInfo) -> str:
+        headers = info.headers
+        if not headers:
+            return ""
+        keys = tuple(headers)
+        i = _casefolded_keys(keys).get(name)
+        return "" if i is None else _clean_header(headers[keys[i]])
+
+    return header
 
 
 class NNTPGroup(abc.ABC):
@@ -228,336 +531,2084 @@ class NNTPGroup(abc.ABC):
     def posting_permitted(self) -> bool:
         ...
 
+    @property
+    def index(self) -> typing.Optional["ArticleNumberIndex"]:
+        """The sorted article numbers of this group, if the backend keeps them.
 
-class NNTPServer(abc.ABC, socketserver.ThreadingMixIn, socketserver.TCPServer):
-    overview_format: typing.List[str] = _DEFAULT_OVERVIEW_FMT
+        When available it is used for range queries (LISTGROUP, OVER, HDR)
+        and NEXT/LAST instead of probing every number."""
+        return None
 
-    def __init__(
-        self,
-        *args: typing.Any,
-        auth: NNTPAuthSetting = NNTPAuthSetting.NOAUTH,
-        can_post: NNTPPostSetting = NNTPPostSetting.NOPOST,
-        use_ssl: bool = False,
-        certfile: typing.Optional[str] = None,
-        keyfile: typing.Optional[str] = None,
-        **kwargs: typing.Any,
-    ) -> None:
-        self.auth = auth
-        self.certfile = certfile
-        self.keyfile = keyfile
-        self.ssl_version = None
-        self.can_post = can_post
-        if use_ssl:
-            if not certfile or not keyfile:
-                raise ValueError(
-                    "You must provide certfile and keyfile keyword arguments in NNTPServer.__init__ when use_ssl is True."
-                )
-            if not _have_ssl:
-                raise ValueError(
-                    "You set use_ssl to True but the ssl module could not be imported."
-                )
-            self.ssl_version = ssl_version = ssl.PROTOCOL_TLS
-        super().__init__(*args, **kwargs)
+    @property
+    def arrivals(self) -> typing.Optional["ArrivalIndex"]:
+        """The message-ids of this group by arrival time, if the backend
+        keeps them. When available NEWNEWS uses it instead of scanning every
+        article of the group."""
+        return None
 
-    def get_request(self) -> typing.Tuple[typing.Any, typing.Tuple[str, int]]:
-        if self.ssl_version:
-            newsocket, fromaddr = self.socket.accept()
-            connstream = ssl.wrap_socket(
-                newsocket,
-                server_side=True,
-                certfile=self.certfile,
-                keyfile=self.keyfile,
-                ssl_version=self.ssl_version,
-            )
-            return connstream, fromaddr
-        return super().get_request()
 
-    @abc.abstractmethod
-    def refresh(self) -> None:
-        """Hook for refreshing internal state before processing article/group commands"""
-        ...
+class ArticleNumberIndex:
+    """A sorted set of article numbers stored in a compact array.
+
+    low, high and count are O(1), range queries and neighbour lookups use
+    bisection. Backends add numbers as articles arrive; appending a number
+    higher than all others is O(1).
+    """
+
+    def __init__(self, numbers: typing.Iterable[int] = ()) -> None:
+        self._numbers = array.array("q", sorted(set(numbers)))
+        self._lock = threading.Lock()
+
+    def add(self, number: int) -> int:
+        """Insert number and return its position in the index."""
+        with self._lock:
+            numbers = self._numbers
+            if not numbers or number > numbers[-1]:
+                numbers.append(number)
+                return len(numbers) - 1
+            i = bisect.bisect_left(numbers, number)
+            if numbers[i] != number:
+                numbers.insert(i, number)
+            return i
+
+    def position(self, number: int) -> typing.Optional[int]:
+        """Return the position of number in the index, if present."""
+        numbers = self._numbers
+        i = bisect.bisect_left(numbers, number)
+        if i < len(numbers) and numbers[i] == number:
+            return i
+        return None
+
+    def span(self, low: int, high: int) -> typing.Tuple[int, int]:
+        """Return the [start, stop) positions of the numbers in [low, high]."""
+        numbers = self._numbers
+        return bisect.bisect_left(numbers, low), bisect.bisect_right(numbers, high)
+
+    def discard(self, number: int) -> None:
+        with self._lock:
+            i = bisect.bisect_left(self._numbers, number)
+            if i < len(self._numbers) and self._numbers[i] == number:
+                del self._numbers[i]
 
     @property
-    @abc.abstractmethod
-    def groups(self) -> typing.Dict[str, NNTPGroup]:
-        ...
+    def low(self) -> int:
+        return self._numbers[0] if self._numbers else 0
 
     @property
-    @abc.abstractmethod
-    def articles(self) -> typing.Dict[typing.Union[int, str], ArticleInfo]:
-        ...
+    def high(self) -> int:
+        return self._numbers[-1] if self._numbers else 0
 
-    @abc.abstractmethod
-    def article(self, key: typing.Union[str, int]) -> Article:
-        ...
+    @property
+    def count(self) -> int:
+        return len(self._numbers)
 
-    def date(self) -> datetime.datetime:
-        return datetime.datetime.utcnow()
+    def range(self, low: int, high: int) -> typing.Sequence[int]:
+        """Return the numbers n with low <= n <= high, in ascending order."""
+        start, stop = self.span(low, high)
+        return self._numbers[start:stop]
 
-    def newnews(
-        self, wildmat: str, date: datetime.datetime
-    ) -> typing.Optional[typing.Iterator[ArticleInfo]]:
-        return None
+    def next(self, number: int) -> typing.Optional[int]:
+        """Return the smallest number greater than number, if any."""
+        numbers = self._numbers
+        i = bisect.bisect_right(numbers, number)
+        return numbers[i] if i < len(numbers) else None
 
-    def newgroups(
-        self, date: datetime.datetime
-    ) -> typing.Optional[typing.List[NNTPGroup]]:
-        return None
+    def previous(self, number: int) -> typing.Optional[int]:
+        """Return the greatest number less than number, if any."""
+        numbers = self._numbers
+        i = bisect.bisect_left(numbers, number)
+        return numbers[i - 1] if i > 0 else None
 
-    @property
-    def debugging(self) -> bool:
-        return False
+    def __contains__(self, number: object) -> bool:
+        if not isinstance(number, int):
+            return False
+        return self.position(number) is not None
 
-    def auth_user(self, user: str, password: str) -> bytes:
-        """Return an auth token on success. This token will be passed to the server for authenticated actions like POSTing articles."""
-        raise NNTPAuthenticationError("Authentication not supported")
+    def __len__(self) -> int:
+        return len(self._numbers)
 
-    def post(self, auth_token: typing.Optional[bytes], lines: str) -> None:
-        raise NNTPPostError("Posting not supported")
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._numbers)
+
+
+class GroupWatermarks(typing.NamedTuple):
+    """The low and high article numbers and article count of a group."""
+
+    low: int
+    high: int
+    # Not "count", which would shadow tuple.count()
+    total: int
+
+
+class LazyArticleNumberIndex(ArticleNumberIndex):
+    """An ArticleNumberIndex filled in the background after startup.
+
+    Until load() is called, low, high and count come from watermarks, a
+    small metadata record that a backend can read cheaply when it starts
+    (e.g. MIN(), MAX() and COUNT() of an indexed column), and every other
+    lookup waits for load(). Numbers added in the meantime are kept.
+    """
+
+    def __init__(self, watermarks: GroupWatermarks) -> None:
+        super().__init__()
+        self.watermarks = watermarks
+        self.loaded = threading.Event()
+
+    def load(self, numbers: typing.Iterable[int]) -> None:
+        """Fill the index with numbers, in ascending order.
+
+        If numbers raises, the index is marked loaded with the numbers read
+        so far, so that lookups do not wait forever."""
+        loaded = array.array("q")
+        try:
+            loaded.extend(numbers)
+        finally:
+            with self._lock:
+                added, self._numbers = self._numbers, loaded
+            for number in added:
+                self.add(number)
+            self.loaded.set()
+
+    def position(self, number: int) -> typing.Optional[int]:
+        self.loaded.wait()
+        return super().position(number)
+
+    def span(self, low: int, high: int) -> typing.Tuple[int, int]:
+        self.loaded.wait()
+        return super().span(low, high)
+
+    def discard(self, number: int) -> None:
+        self.loaded.wait()
+        super().discard(number)
 
     @property
-    def subscriptions(self) -> typing.Optional[typing.List[str]]:
-        return None
+    def low(self) -> int:
+        if self.loaded.is_set() or not self.watermarks.total:
+            return super().low
+        return self.watermarks.low
 
     @property
-    def help(self) -> typing.Optional[str]:
-        """Return an informational help text to the user. If None, a generic message will be generated."""
-        return None
+    def high(self) -> int:
+        if self.loaded.is_set():
+            return super().high
+        return max(self.watermarks.high, super().high)
 
+    @property
+    def count(self) -> int:
+        if self.loaded.is_set():
+            return super().count
+        return self.watermarks.total + len(self._numbers)
 
-class NNTPConnectionHandler(socketserver.BaseRequestHandler):
-    """
-    The request handler class for our server.
+    def next(self, number: int) -> typing.Optional[int]:
+        self.loaded.wait()
+        return super().next(number)
 
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
-    """
+    def previous(self, number: int) -> typing.Optional[int]:
+        self.loaded.wait()
+        return super().previous(number)
 
-    server: NNTPServer
+    def __len__(self) -> int:
+        return self.count
 
-    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
-        print("New connection.")
-        # self.command_queue = collections.deque()
-        self.command_history: typing.List[str] = []
-        self._init: bool = True
-        self._quit: bool = False
-        self._authed: bool = False
-        self._auth_token: typing.Optional[bytes] = None
-        self._authed_user: typing.Optional[str] = None
-        self._buffer: bytes = b""
-        self.current_selected_newsgroup: typing.Optional[str] = None
-        self.current_article_number: typing.Optional[int] = None
-        super().__init__(*args, **kwargs)
+    def __iter__(self) -> typing.Iterator[int]:
+        self.loaded.wait()
+        return super().__iter__()
 
-    def handle(self) -> None:
-        if self._quit:
-            raise Exception("QUIT??")
-        if self._init:
-            if self.server.can_post:
-                self.send_lines(["200 NNTP Service Ready, posting allowed"])
-            else:
-                self.send_lines(["201 NNTP Service Ready, posting prohibited"])
-            self._init = False
-        # self.request is the TCP socket connected to the client
-        while True:
-            try:
-                self.data = self._getline()
-            except NNTPDataError as exc:
-                print(f"Data error: {exc}")
-                self._quit = True
-                self.send_lines(["205 Connection closing"])
-                return
-            data_caseless = self.data.casefold()
-            if not self.data:
-                continue
-            if self.server.debugging and not data_caseless.startswith("authinfo"):
-                print("got:", self.data)
-            if data_caseless == "capabilities":
-                self.capabilities()
-            elif data_caseless.startswith("authinfo"):
-                self.auth()
-            elif data_caseless == "post":
-                allow = False
-                if self.server.can_post and not (
-                    self.server.can_post & NNTPPostSetting.AUTHREQUIRED
-                ):
-                    allow = True
-                elif self._authed and (
-                    self.server.can_post & NNTPPostSetting.AUTHREQUIRED
-                ):
-                    allow = True
-                elif not self._authed or not self.server.can_post:
-                    pass
-                elif not self._authed and (
-                    self.server.can_post & NNTPPostSetting.AUTHREQUIRED
-                ):
-                    pass
-                if not allow:
-                    self.send_lines(["440 Posting not permitted"])
-                else:
-                    self.send_lines(["340 Input article; end with <CR-LF>.<CR-LF>"])
-                    try:
-                        lines = self._getlines()
-                        self.server.post(self._auth_token, lines)
-                        self.send_lines(["240 Article received OK"])
-                    except NNTPDataError as exc:
-                        print(f"Data error: {exc}")
-                        self._quit = True
-                        self.send_lines(["205 Connection closing"])
-                        return
-                    except NNTPPostError as exc:
-                        self.send_lines([f"441 Posting failed: {exc.response}"])
-            elif data_caseless.startswith("group"):
-                _, group_name = self.data.split()
-                self.select_group(group_name)
-            elif data_caseless.startswith("over") or data_caseless.startswith("xover"):
-                self.overview()
-            elif data_caseless.startswith("hdr") or data_caseless.startswith("xhdr"):
-                self.hdr()
-            elif data_caseless.startswith("stat"):
-                self.stat()
-            elif data_caseless.startswith("article"):
-                self.article()
-            elif data_caseless.startswith("body"):
-                self.article(body=True)
-            elif data_caseless.startswith("head"):
-                self.head()
-            elif data_caseless == "help":
-                self.help()
-            elif data_caseless.startswith("listgroup"):
-                self.listgroup()
-            elif (
-                data_caseless == "list newsgroups"
-                or data_caseless == "list"
-                or data_caseless.startswith("list active")
-            ):
-                self.list()
-            elif data_caseless == "list subscriptions":
-                subs: typing.Optional[typing.List[str]] = self.server.subscriptions
-                if subs is None:
-                    self.send_lines(["503 No list of recommended newsgroups available"])
-                else:
-                    self.send_lines(
-                        ["215 List of recommended newsgroups follows"] + subs + ["."]
-                    )
-            elif data_caseless == "mode reader":
-                if self.server.can_post:
-                    self.send_lines(["200 NNTP Service Ready, posting allowed"])
-                else:
-                    self.send_lines(["201 NNTP Service Ready, posting prohibited"])
-            elif data_caseless == "list overview.fmt":
-                self.send_lines(
-                    ["215 Order of fields in overview database."]
-                    + self.server.overview_format
-                    + ["."]
-                )
-            elif data_caseless == "date":
-                date = self.server.date()
-                self.send_lines([f"111 {''.join(format_datetime(date))}"])
-            elif data_caseless.startswith("newnews"):
-                self.newnews()
-            elif data_caseless.startswith("newgroups"):
-                self.newgroups()
-            elif data_caseless == "quit":
-                self._quit = True
-                self.send_lines(["205 Connection closing"])
-                return
-            else:
-                self.send_lines(["500 Unknown command"])
-                continue
-            self.command_history.append(self.data)
 
-    AUTHINFO_RE = re.compile(
-        r"^authinfo\s*(?P<keyword>(?:pass)|(?:user))\s*(?P<value>.*)$",
-        re.IGNORECASE,
-    )
+class MessageIdIndex:
+    """Maps message-ids to the (group name, article number) they were filed
+    under, for constant time <message-id> lookups across all groups.
 
-    def auth(self) -> None:
-        self.server.refresh()
-        # Don't use .split() because password may contain white spaces
-        match = self.AUTHINFO_RE.search(self.data.strip())
-        if not match:
-            self.send_lines(["501 Syntax Error"])
-            return
-        keyword = match.group("keyword").casefold()
-        value = match.group("value")
-        if not self.server.auth or self._authed:
-            self.send_lines(["502 Command unavailable"])
-            return
-        if keyword == "user":
-            self._authed_user = value
-            self.send_lines(["381 Enter passphrase"])
-            return
+    Each entry is a single int packing the article number with the ordinal
+    of the group name, so names are stored once per group rather than once
+    per article. Backends add entries as articles are loaded or posted.
+    """
 
-        if not self._authed_user:
-            self.send_lines(["482 Authentication commands issued out of sequence"])
-            return
+    _GROUP_BITS = 20
+
+    def __init__(self) -> None:
+        self._ids: typing.Dict[str, int] = {}
+        self._group_names: typing.List[str] = []
+        self._group_ordinals: typing.Dict[str, int] = {}
+        self._lock = threading.Lock()
 
+    def _ordinal(self, group: str) -> int:
         try:
-            self._auth_token = self.server.auth_user(self._authed_user, value)
-            self.send_lines([f"281 Authentication accepted"])
-            self._authed = True
-        except NNTPAuthenticationError as exc:
-            self.send_lines([f"481 {exc.response}"])
+            return self._group_ordinals[group]
+        except KeyError:
+            pass
+        with self._lock:
+            if group not in self._group_ordinals:
+                if len(self._group_names) >= 1 << self._GROUP_BITS:
+                    raise ValueError("Too many groups in MessageIdIndex")
+                self._group_ordinals[group] = len(self._group_names)
+                self._group_names.append(group)
+            return self._group_ordinals[group]
 
-    def capabilities(self) -> None:
-        show_auth = False
-        if not self._authed and self.server.auth:
-            if (
-                self.server.auth & NNTPAuthSetting.SECUREONLY
-            ) and not self.server.ssl_version:
-                pass
-            else:
-                show_auth = True
+    def add(self, message_id: str, group: str, number: int) -> None:
+        self._ids[message_id] = (number << self._GROUP_BITS) | self._ordinal(group)
 
-        capabilities = [
-            "101 Capability list:",
-            "VERSION 2",
-            "READER",
-            "HDR",
-            "NEWNEWS",
-            "LIST ACTIVE NEWSGROUPS OVERVIEW.FMT SUBSCRIPTIONS",
-            "OVER MSGID",
-        ]
-        if self.server.can_post:
-            capabilities.append("POST")
-        if show_auth:
-            capabilities.append("AUTHINFO USER")
-        capabilities.append(".")
-        self.send_lines(capabilities)
+    def discard(self, message_id: str) -> None:
+        self._ids.pop(message_id, None)
 
-    def newnews(self) -> None:
-        self.server.refresh()
-        command, *tokens = self.data.strip().split()
-        if len(tokens) < 2:
-            self.send_lines(["501 Syntax Error"])
-            return
-        wildmat, date_str, time_str, *gmt = tokens
+    def get(self, message_id: str) -> typing.Optional[typing.Tuple[str, int]]:
         try:
-            date = parse_datetime(date_str, time_str=time_str)
-        except TypeError:
-            self.send_lines(["501 Syntax Error"])
-            return
-        # Check if server implements newnews, otherwise compute newnews on our own.
-        articles = self.server.newnews(wildmat, date)
-        if articles is None:
-            articles = filter(
-                lambda a: a.date >= date,
-                itertools.chain.from_iterable(
-                    g.articles.values()
-                    for g in filter(
-                        lambda g: g.name == wildmat, self.server.groups.values()
-                    )
-                ),
+            value = self._ids[message_id]
+        except KeyError:
+            return None
+        mask = (1 << self._GROUP_BITS) - 1
+        return (self._group_names[value & mask], value >> self._GROUP_BITS)
+
+    def __contains__(self, message_id: object) -> bool:
+        return message_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class ArrivalIndex:
+    """The message-ids of a group's articles ordered by arrival time, so that
+    NEWNEWS finds the articles that arrived since a date by bisection.
+
+    Times are stored as epoch seconds in an array. Articles normally arrive
+    in time order, which makes adding one an O(1) append.
+    """
+
+    def __init__(self) -> None:
+        self._times = array.array("q")
+        self._message_ids: typing.List[str] = []
+        self._lock = threading.Lock()
+
+    def add(self, message_id: str, arrived: datetime.datetime) -> None:
+        when = int(arrived.timestamp())
+        with self._lock:
+            times = self._times
+            if not times or when >= times[-1]:
+                times.append(when)
+                self._message_ids.append(message_id)
+            else:
+                i = bisect.bisect_right(times, when)
+                times.insert(i, when)
+                self._message_ids.insert(i, message_id)
+
+    def since(self, date: datetime.datetime) -> typing.List[str]:
+        """Return the message-ids of the articles that arrived at or after
+        date, oldest first."""
+        with self._lock:
+            i = bisect.bisect_left(self._times, date.timestamp())
+            return self._message_ids[i:]
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+
+class ActiveFile:
+    """A snapshot of the group list in wire form, for LIST ACTIVE and LIST
+    NEWSGROUPS.
+
+    The response lines of all groups are encoded once per version (see
+    NNTPBackend.active_file()). Group names are also kept sorted, so that a
+    wildmat argument only tests the names that share the literal prefix of
+    one of its patterns, found by bisection.
+    """
+
+    def __init__(
+        self, groups: typing.Iterable[NNTPGroup], version: typing.Hashable = None
+    ) -> None:
+        self.version = version
+        names: typing.List[str] = []
+        self._active: typing.List[bytes] = []
+        self._newsgroups: typing.List[bytes] = []
+        for group in groups:
+            name = group.name
+            status = "y" if group.posting_permitted else "n"
+            names.append(name)
+            self._active.append(
+                f"{name} {group.high} {group.low} {status}\r\n".encode("utf-8")
+            )
+            self._newsgroups.append(
+                f"{name}\t{group.short_description}\r\n".encode("utf-8")
+            )
+        self._all_active = b"".join(self._active)
+        self._all_newsgroups = b"".join(self._newsgroups)
+        # Positions of the groups in name order, and their names
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self._order = array.array("q", order)
+        self._sorted_names = [names[i] for i in order]
+
+    def positions(self, wildmat: str) -> typing.List[int]:
+        """Return the positions of the groups matching wildmat, in the order
+        the groups were listed."""
+        names = self._sorted_names
+        spans = []
+        for pattern in wildmat.split(","):
+            if pattern.startswith("!"):
+                continue
+            prefix = re.split(r"[*?]", pattern, 1)[0]
+            if not prefix:
+                spans = [(0, len(names))]
+                break
+            spans.append(
+                (
+                    bisect.bisect_left(names, prefix),
+                    bisect.bisect_left(names, prefix + "\U0010ffff"),
+                )
+            )
+        matches = compile_wildmat(wildmat)
+        positions = set()
+        for start, stop in spans:
+            for i in range(start, stop):
+                if matches(names[i]):
+                    positions.add(self._order[i])
+        return sorted(positions)
+
+    def active(self, wildmat: typing.Optional[str] = None) -> bytes:
+        """Return the LIST ACTIVE lines of the groups matching wildmat."""
+        if wildmat is None or wildmat == "*":
+            return self._all_active
+        return b"".join(self._active[i] for i in self.positions(wildmat))
+
+    def newsgroups(self, wildmat: typing.Optional[str] = None) -> bytes:
+        """Return the LIST NEWSGROUPS lines of the groups matching wildmat."""
+        if wildmat is None or wildmat == "*":
+            return self._all_newsgroups
+        return b"".join(self._newsgroups[i] for i in self.positions(wildmat))
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+
+class Histogram:
+    """Counts of observed values per bucket, with cumulative le semantics as
+    in Prometheus histograms. Not thread-safe; see Metrics."""
+
+    def __init__(self, buckets: typing.Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the q-quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Counters and latency histograms of a server.
+
+    Handlers record every command with its duration, bytes sent and
+    received and opened connections; the refresh scheduler and warm-up
+    record backend timings. render() returns everything in the Prometheus
+    text exposition format.
+    """
+
+    # Upper bounds, in seconds, of the latency histogram buckets
+    LATENCY_BUCKETS: typing.Tuple[float, ...] = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.commands: typing.Dict[str, Histogram] = {}
+        self.command_errors: typing.Dict[str, int] = {}
+        self.backend: typing.Dict[str, Histogram] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.connections_active = 0
+        self.connections_total = 0
+        self.connections_rejected = 0
+
+    def observe_command(
+        self, command: str, seconds: float, failed: bool = False
+    ) -> None:
+        with self._lock:
+            histogram = self.commands.get(command)
+            if histogram is None:
+                histogram = self.commands[command] = Histogram(self.LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            if failed:
+                self.command_errors[command] = self.command_errors.get(command, 0) + 1
+
+    def observe_backend(self, call: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.backend.get(call)
+            if histogram is None:
+                histogram = self.backend[call] = Histogram(self.LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def add_sent(self, count: int) -> None:
+        with self._lock:
+            self.bytes_sent += count
+
+    def add_received(self, count: int) -> None:
+        with self._lock:
+            self.bytes_received += count
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.connections_active += 1
+            self.connections_total += 1
+
+    def connection_closed(self) -> None:
+        with self._lock:
+            self.connections_active -= 1
+
+    def connection_rejected(self) -> None:
+        with self._lock:
+            self.connections_rejected += 1
+
+    @staticmethod
+    def _render_histograms(
+        lines: typing.List[str],
+        name: str,
+        label: str,
+        histograms: typing.Dict[str, Histogram],
+    ) -> None:
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(histograms.items()):
+            labels = f'{label}="{key}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = ["# TYPE nntp_commands_total counter"]
+            for command, histogram in sorted(self.commands.items()):
+                lines.append(
+                    f'nntp_commands_total{{command="{command}"}} {histogram.count}'
+                )
+            lines.append("# TYPE nntp_command_errors_total counter")
+            for command, count in sorted(self.command_errors.items()):
+                lines.append(
+                    f'nntp_command_errors_total{{command="{command}"}} {count}'
+                )
+            self._render_histograms(
+                lines, "nntp_command_duration_seconds", "command", self.commands
+            )
+            self._render_histograms(
+                lines, "nntp_backend_duration_seconds", "call", self.backend
+            )
+            lines += [
+                "# TYPE nntp_sent_bytes_total counter",
+                f"nntp_sent_bytes_total {self.bytes_sent}",
+                "# TYPE nntp_received_bytes_total counter",
+                f"nntp_received_bytes_total {self.bytes_received}",
+                "# TYPE nntp_connections_active gauge",
+                f"nntp_connections_active {self.connections_active}",
+                "# TYPE nntp_connections_total counter",
+                f"nntp_connections_total {self.connections_total}",
+                "# TYPE nntp_connections_rejected_total counter",
+                f"nntp_connections_rejected_total {self.connections_rejected}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> typing.List[str]:
+        """Return one human readable line per command and backend call with
+        its count and approximate median and 99th percentile latency."""
+        with self._lock:
+            items = [(f"command {k}", v) for k, v in sorted(self.commands.items())]
+            items += [(f"backend {k}", v) for k, v in sorted(self.backend.items())]
+            lines = [
+                f"{name} count={h.count} "
+                f"p50<={h.quantile(0.5)}s p99<={h.quantile(0.99)}s"
+                for name, h in items
+            ]
+            lines.append(
+                f"connections active={self.connections_active} "
+                f"total={self.connections_total} "
+                f"bytes sent={self.bytes_sent} received={self.bytes_received}"
+            )
+        return lines
+
+    def write_textfile(self, path: str) -> None:
+        """Atomically replace path with render(), e.g. for the textfile
+        collector of the Prometheus node exporter."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+class ConnectionLimiter:
+    """Counts open connections, in total and per client address, against
+    optional limits."""
+
+    def __init__(
+        self,
+        max_connections: typing.Optional[int] = None,
+        max_connections_per_ip: typing.Optional[int] = None,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.active = 0
+        self._per_ip: typing.Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, address: str) -> typing.Optional[str]:
+        """Count a new connection from address, or return the reason it is
+        refused without counting it."""
+        with self._lock:
+            if self.max_connections is not None and self.active >= self.max_connections:
+                return "Too many connections"
+            count = self._per_ip.get(address, 0)
+            if (
+                self.max_connections_per_ip is not None
+                and count >= self.max_connections_per_ip
+            ):
+                return "Too many connections from your address"
+            self.active += 1
+            self._per_ip[address] = count + 1
+            return None
+
+    def release(self, address: str) -> None:
+        with self._lock:
+            self.active -= 1
+            count = self._per_ip.pop(address) - 1
+            if count:
+                self._per_ip[address] = count
+
+
+def _identity(value: typing.Any) -> typing.Any:
+    return value
+
+
+class RefreshScheduler:
+    """Decides when NNTPBackend.refresh() actually runs.
+
+    Handlers call request() before commands that read groups or articles.
+    refresh() then runs at most once per min_interval seconds, and concurrent
+    requests while it is running wait for that single run instead of
+    starting their own. With background set, a daemon thread started by
+    start() refreshes every min_interval seconds and requests never wait,
+    except for the very first refresh.
+    """
+
+    def __init__(
+        self,
+        refresh: typing.Callable[[], typing.Any],
+        min_interval: float = 0.0,
+        background: bool = False,
+        metrics: typing.Optional[Metrics] = None,
+    ) -> None:
+        self.refresh = refresh
+        self.min_interval = min_interval
+        self.background = background
+        self.metrics = metrics
+        self.last_refresh: typing.Optional[float] = None
+        self._running = False
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def stale(self) -> bool:
+        return (
+            self.last_refresh is None
+            or time.monotonic() - self.last_refresh >= self.min_interval
+        )
+
+    def request(
+        self, resolve: typing.Callable[[typing.Any], typing.Any] = _identity
+    ) -> None:
+        """Refresh if the data is stale, or wait for an ongoing refresh.
+
+        resolve is applied to the return value of refresh(), so that a
+        coroutine hook can be awaited by the caller's event loop."""
+        if self._thread is not None and self.last_refresh is not None:
+            return
+        if not self.stale:
+            return
+        with self._cond:
+            if self._running:
+                generation = self._generation
+                while self._running and generation == self._generation:
+                    self._cond.wait()
+                return
+            if not self.stale:
+                return
+            self._running = True
+        self._run(resolve)
+
+    def _run(self, resolve: typing.Callable[[typing.Any], typing.Any]) -> None:
+        start = time.perf_counter()
+        try:
+            resolve(self.refresh())
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_backend("refresh", time.perf_counter() - start)
+            with self._cond:
+                self._running = False
+                # A failed refresh is not retried before min_interval either, so
+                # an unavailable upstream is not hammered by every command.
+                self.last_refresh = time.monotonic()
+                self._generation += 1
+                self._cond.notify_all()
+
+    def start(
+        self, resolve: typing.Callable[[typing.Any], typing.Any] = _identity
+    ) -> None:
+        """Start the background refresher thread if background is set."""
+        if not self.background or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, args=(resolve,), name="nntp-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _loop(self, resolve: typing.Callable[[typing.Any], typing.Any]) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                if self._running:
+                    run = False
+                else:
+                    self._running = run = True
+            if run:
+                try:
+                    self._run(resolve)
+                except Exception:
+                    _logger.exception("Background refresh failed")
+            self._stop.wait(max(self.min_interval, 1.0))
+
+
+class ArticleStore(collections.abc.Mapping):
+    """Compact, column oriented storage of the overview data of a group.
+
+    Instead of one ArticleInfo (with its datetime and headers dict) per
+    article, every field is kept in a column: numbers, dates (as epoch
+    seconds), sizes and line counts in arrays, strings in lists with author
+    names interned, and extra headers as a tuple of values plus the id of a
+    shared tuple of header names. ArticleInfo objects are only built when an
+    article is looked up.
+
+    The store maps article numbers to ArticleInfo, so it can be returned from
+    NNTPGroup.articles and NNTPBackend.articles, and its index from
+    NNTPGroup.index. Dates are returned in UTC with second precision.
+    """
+
+    # Number of rows range() builds per acquisition of the lock
+    _RANGE_BATCH = 256
+
+    def __init__(self, articles: typing.Iterable[ArticleInfo] = ()) -> None:
+        self.index = ArticleNumberIndex()
+        self._dates = array.array("q")
+        self._bytes = array.array("q")
+        self._lines = array.array("q")
+        self._schema_ids = array.array("l")
+        self._subjects: typing.List[str] = []
+        self._froms: typing.List[str] = []
+        self._message_ids: typing.List[str] = []
+        self._references: typing.List[str] = []
+        self._header_values: typing.List[typing.Tuple[str, ...]] = []
+        self._schemas: typing.List[typing.Tuple[str, ...]] = [()]
+        self._schema_ids_by_keys: typing.Dict[typing.Tuple[str, ...], int] = {(): 0}
+        self._lock = threading.Lock()
+        for info in articles:
+            self.add(info)
+
+    def _schema_id(self, keys: typing.Tuple[str, ...]) -> int:
+        # Called with self._lock held
+        try:
+            return self._schema_ids_by_keys[keys]
+        except KeyError:
+            keys = tuple(map(sys.intern, keys))
+            self._schema_ids_by_keys[keys] = len(self._schemas)
+            self._schemas.append(keys)
+            return len(self._schemas) - 1
+
+    def add(self, info: ArticleInfo) -> None:
+        """Insert info, replacing any article with the same number."""
+        keys = tuple(info.headers)
+        row = [
+            int(info.date.timestamp()),
+            info.bytes,
+            info.lines,
+            0,
+            info.subject,
+            sys.intern(info.from_),
+            info.message_id,
+            info.references,
+            tuple(info.headers.values()),
+        ]
+        columns = (
+            self._dates,
+            self._bytes,
+            self._lines,
+            self._schema_ids,
+            self._subjects,
+            self._froms,
+            self._message_ids,
+            self._references,
+            self._header_values,
+        )
+        with self._lock:
+            row[3] = self._schema_id(keys)
+            count = len(self.index)
+            i = self.index.add(info.number)
+            if len(self.index) == count:
+                for column, value in zip(columns, row):
+                    column[i] = value  # type: ignore[index]
+            else:
+                for column, value in zip(columns, row):
+                    column.insert(i, value)  # type: ignore[attr-defined]
+
+    def _row(self, i: int) -> ArticleInfo:
+        # Called with self._lock held, so that add() cannot change the
+        # columns between reads
+        keys = self._schemas[self._schema_ids[i]]
+        return ArticleInfo(
+            self.index._numbers[i],
+            self._subjects[i],
+            self._froms[i],
+            datetime.datetime.fromtimestamp(self._dates[i], datetime.timezone.utc),
+            self._message_ids[i],
+            self._references[i],
+            self._bytes[i],
+            self._lines[i],
+            dict(zip(keys, self._header_values[i])) if keys else {},
+        )
+
+    def range(self, low: int, high: int) -> typing.Iterator[ArticleInfo]:
+        """Yield the articles numbered from low to high, in order; suitable
+        for NNTPBackend.iter_range()."""
+        # Rows are built in batches, so that add() is not blocked while
+        # the caller consumes them
+        while True:
+            with self._lock:
+                start, stop = self.index.span(low, high)
+                stop = min(stop, start + self._RANGE_BATCH)
+                rows = [self._row(i) for i in range(start, stop)]
+            yield from rows
+            if len(rows) < self._RANGE_BATCH:
+                return
+            low = rows[-1].number + 1
+
+    def header(
+        self, low: int, high: int, field: str
+    ) -> typing.Iterator[typing.Tuple[int, str]]:
+        """Yield (number, value) of field for the articles numbered from low
+        to high, as header_accessor(field) would return it, reading only the
+        field's column; suitable for NNTPBackend.hdr_range()."""
+        name = field.casefold()
+        attribute = _HEADER_ATTRIBUTES.get(name)
+        with self._lock:
+            start, stop = self.index.span(low, high)
+            numbers = self.index._numbers[start:stop]
+            if name == "date":
+                column: typing.Sequence[typing.Any] = self._dates[start:stop]
+            elif attribute is not None:
+                columns: typing.Dict[str, typing.Sequence[typing.Any]] = {
+                    "subject": self._subjects,
+                    "from_": self._froms,
+                    "message_id": self._message_ids,
+                    "references": self._references,
+                    "bytes": self._bytes,
+                    "lines": self._lines,
+                }
+                column = columns[attribute][start:stop]
+            else:
+                column = self._header_values[start:stop]
+                schema_ids = self._schema_ids[start:stop]
+                schemas = list(self._schemas)
+        values: typing.Iterable[str]
+        if name == "date":
+            utc = datetime.timezone.utc
+            values = (
+                email.utils.format_datetime(datetime.datetime.fromtimestamp(t, utc))
+                for t in column
+            )
+        elif attribute in ("bytes", "lines"):
+            values = map(str, column)
+        elif attribute is not None:
+            values = map(_clean_header, column)
+        else:
+            # Position of the header in each schema, or None
+            positions = [_casefolded_keys(keys).get(name) for keys in schemas]
+            values = (
+                "" if p is None else _clean_header(row[p])
+                for p, row in zip(map(positions.__getitem__, schema_ids), column)
+            )
+        return zip(numbers, values)
+
+    @property
+    def low(self) -> int:
+        return self.index.low
+
+    @property
+    def high(self) -> int:
+        return self.index.high
+
+    @property
+    def count(self) -> int:
+        return self.index.count
+
+    def __getitem__(self, number: typing.Union[int, str]) -> ArticleInfo:
+        if isinstance(number, int):
+            with self._lock:
+                i = self.index.position(number)
+                if i is not None:
+                    return self._row(i)
+        raise NNTPArticleNotFound(str(number))
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+def _write_all(fd: int, data: typing.Union[bytes, bytearray]) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+class OverviewFile:
+    """The on-disk overview data of one group.
+
+    Overview lines are appended in wire form, in ascending article number
+    order, to NAME.overview, and NAME.index holds one record per article of
+    two native 64-bit integers: its number and the end offset of its line.
+    Both files are read through mmap, so the overview of a range of articles
+    is one slice of the mapped overview file and no Python object is created
+    per article. Files grown by another process are remapped on next access.
+
+    The files are opened read-only, and for writing only by the first
+    extend(). Writers hold an exclusive flock() on the index file while they
+    append, and before that drop the partial record or unindexed data a
+    crashed writer may have left, so several processes may write to the same
+    group. Without fcntl (on Windows) only one process may write to a group.
+    Readers never modify the files and ignore a trailing partial record.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        flags = os.O_RDONLY | os.O_CREAT
+        self._data_fd = os.open(path + ".overview", flags, 0o644)
+        self._index_fd = os.open(path + ".index", flags, 0o644)
+        self._writer: typing.Optional[typing.Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._mapped_size = 0
+        self._view: typing.Tuple[
+            typing.Sequence[int], typing.Sequence[int], memoryview
+        ] = ((), (), memoryview(b""))
+
+    def _snapshot(
+        self,
+    ) -> typing.Tuple[typing.Sequence[int], typing.Sequence[int], memoryview]:
+        """Return the mapped (numbers, end offsets, overview data)."""
+        size = os.fstat(self._index_fd).st_size
+        size -= size % _OVERVIEW_RECORD_SIZE
+        if size != self._mapped_size:
+            with self._lock:
+                if size > self._mapped_size:
+                    # Previous mappings are left to the garbage collector, as
+                    # responses being sent may still refer to them.
+                    index = mmap.mmap(self._index_fd, size, access=mmap.ACCESS_READ)
+                    records = memoryview(index).cast("q")
+                    ends = records[1::2]
+                    data = mmap.mmap(self._data_fd, ends[-1], access=mmap.ACCESS_READ)
+                    self._view = (records[0::2], ends, memoryview(data))
+                    self._mapped_size = size
+        return self._view
+
+    def append(self, number: int, line: bytes) -> None:
+        """Append the CRLF terminated overview line of article number."""
+        self.extend([(number, line)])
+
+    def extend(self, lines: typing.Iterable[typing.Tuple[int, bytes]]) -> None:
+        """Append (number, line) pairs with two writes.
+
+        Raises ValueError, without writing anything, if the numbers are not
+        above every number already in the file and ascending."""
+        with self._lock:
+            if self._writer is None:
+                flags = os.O_WRONLY | os.O_APPEND
+                data_fd = os.open(self.path + ".overview", flags)
+                try:
+                    self._writer = (data_fd, os.open(self.path + ".index", flags))
+                except OSError:
+                    os.close(data_fd)
+                    raise
+            data_fd, index_fd = self._writer
+            if _have_fcntl:
+                fcntl.flock(index_fd, fcntl.LOCK_EX)
+            try:
+                self._append(data_fd, index_fd, lines)
+            finally:
+                if _have_fcntl:
+                    fcntl.flock(index_fd, fcntl.LOCK_UN)
+
+    def _append(
+        self,
+        data_fd: int,
+        index_fd: int,
+        lines: typing.Iterable[typing.Tuple[int, bytes]],
+    ) -> None:
+        # Drop a partial index record and overview data without an index
+        # record, left by a writer that crashed between the two writes, so
+        # that the offsets of the new records stay correct.
+        index_size = os.fstat(index_fd).st_size
+        if index_size % _OVERVIEW_RECORD_SIZE:
+            index_size -= index_size % _OVERVIEW_RECORD_SIZE
+            os.ftruncate(index_fd, index_size)
+        high = end = 0
+        if index_size:
+            last = array.array("q")
+            last.frombytes(
+                os.pread(
+                    self._index_fd,
+                    _OVERVIEW_RECORD_SIZE,
+                    index_size - _OVERVIEW_RECORD_SIZE,
+                )
+            )
+            high, end = last
+        if os.fstat(data_fd).st_size > end:
+            os.ftruncate(data_fd, end)
+        data_size = end
+        data = bytearray()
+        records = array.array("q")
+        for number, line in lines:
+            if number <= high:
+                raise ValueError(f"{self.path}: article {number} is not above {high}")
+            data += line
+            end += len(line)
+            records.append(number)
+            records.append(end)
+            high = number
+        if not records:
+            return
+        # Data goes first so that readers never see a record without its
+        # line.
+        try:
+            _write_all(data_fd, data)
+            _write_all(index_fd, records.tobytes())
+        except OSError:
+            os.ftruncate(index_fd, index_size)
+            os.ftruncate(data_fd, data_size)
+            raise
+
+    def span(self, low: int, high: int) -> typing.Tuple[int, int]:
+        """Return the [start, stop) records of the articles in [low, high]."""
+        numbers, _ends, _data = self._snapshot()
+        return bisect.bisect_left(numbers, low), bisect.bisect_right(numbers, high)
+
+    @property
+    def low(self) -> int:
+        numbers, _ends, _data = self._snapshot()
+        return numbers[0] if numbers else 0
+
+    @property
+    def high(self) -> int:
+        numbers, _ends, _data = self._snapshot()
+        return numbers[-1] if numbers else 0
+
+    @property
+    def count(self) -> int:
+        numbers, _ends, _data = self._snapshot()
+        return len(numbers)
+
+    def numbers(self, low: int, high: int) -> typing.Sequence[int]:
+        """Return the numbers of the articles in [low, high]."""
+        numbers, _ends, _data = self._snapshot()
+        return numbers[
+            bisect.bisect_left(numbers, low) : bisect.bisect_right(numbers, high)
+        ]
+
+    def overview(self, low: int, high: int) -> memoryview:
+        """Return the overview lines of the articles in [low, high], in wire
+        form, as a view of the mapped file."""
+        numbers, ends, data = self._snapshot()
+        start = bisect.bisect_left(numbers, low)
+        stop = bisect.bisect_right(numbers, high)
+        if start == stop:
+            return data[0:0]
+        return data[ends[start - 1] if start else 0 : ends[stop - 1]]
+
+    def header(
+        self, low: int, high: int, field: str
+    ) -> typing.Iterator[typing.Tuple[int, bytes]]:
+        """Yield (number, value) of field for the articles in [low, high], as
+        HDR does, from the overview fields and the "Name: value" fields that
+        follow them."""
+        numbers, ends, data = self._snapshot()
+        start = bisect.bisect_left(numbers, low)
+        stop = bisect.bisect_right(numbers, high)
+        column = _OVERVIEW_COLUMNS.get(field.casefold())
+        prefix = field.casefold().encode("utf-8") + b": "
+        begin = ends[start - 1] if start else 0
+        for i in range(start, stop):
+            end = ends[i]
+            fields = bytes(data[begin : end - 2]).split(b"\t")
+            begin = end
+            value = b""
+            if column is not None:
+                value = fields[column]
+            else:
+                for extra in fields[8:]:
+                    if extra[: len(prefix)].lower() == prefix:
+                        value = extra[len(prefix) :]
+                        break
+            yield numbers[i], value
+
+    def close(self) -> None:
+        self._view = ((), (), memoryview(b""))
+        os.close(self._data_fd)
+        os.close(self._index_fd)
+        if self._writer is not None:
+            for fd in self._writer:
+                os.close(fd)
+            self._writer = None
+
+
+class OverviewDatabase:
+    """A directory of OverviewFile, one per group, similar to INN's
+    tradindexed overview.
+
+    Backends call add() or extend() as articles are numbered, and set it as
+    NNTPBackend.overview_db so that OVER, HDR and LISTGROUP ranges are served
+    from the mapped files. Lines are stored as the default
+    NNTPBackend.overview_line() encodes them.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._files: typing.Dict[str, OverviewFile] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, group: str) -> str:
+        if not group or group.startswith(".") or "/" in group or os.sep in group:
+            raise ValueError(f"Invalid newsgroup name {group!r}")
+        return os.path.join(self.directory, group)
+
+    def get(self, group: str) -> typing.Optional[OverviewFile]:
+        """Return the overview file of group, or None if it has none."""
+        file = self._files.get(group)
+        if file is None:
+            path = self._path(group)
+            if not os.path.exists(path + ".index"):
+                return None
+            file = self[group]
+        return file
+
+    def __getitem__(self, group: str) -> OverviewFile:
+        """Return the overview file of group, creating it if needed."""
+        try:
+            return self._files[group]
+        except KeyError:
+            pass
+        with self._lock:
+            if group not in self._files:
+                self._files[group] = OverviewFile(self._path(group))
+            return self._files[group]
+
+    def __contains__(self, group: object) -> bool:
+        return isinstance(group, str) and self.get(group) is not None
+
+    def add(self, group: str, info: ArticleInfo) -> None:
+        """Append the overview of info to group."""
+        self[group].append(info.number, _encode_overview(info))
+
+    def extend(self, group: str, infos: typing.Iterable[ArticleInfo]) -> None:
+        """Append the overviews of infos, in ascending number order, to group."""
+        self[group].extend((info.number, _encode_overview(info)) for info in infos)
+
+    def close(self) -> None:
+        with self._lock:
+            for file in self._files.values():
+                file.close()
+            self._files.clear()
+
+    def __enter__(self) -> "OverviewDatabase":
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.close()
+
+
+class NNTPBackend(abc.ABC):
+    """The storage contract shared by all server flavours.
+
+    Subclass this to implement groups and articles once, and combine it with
+    either NNTPServer (thread per connection) or AsyncNNTPServer (asyncio).
+    """
+
+    overview_format: typing.List[str] = _DEFAULT_OVERVIEW_FMT
+    # Maximum number of encoded overview lines kept by overview_line()
+    overview_cache_size: int = 65536
+    # Maximum number of bytes of encoded article bodies kept by body_wire()
+    body_cache_size: int = 64 * 1024 * 1024
+    # If set, <message-id> arguments are resolved with this index first, and
+    # passed to self.articles and self.article() only if it has no entry
+    message_ids: typing.Optional[MessageIdIndex] = None
+    # If set, OVER, HDR and LISTGROUP ranges of the groups it has files for
+    # are read from this database instead of self.articles
+    overview_db: typing.Optional[OverviewDatabase] = None
+    # Minimum number of seconds between two refresh() calls
+    refresh_interval: float = 0.0
+    # Call refresh() every refresh_interval seconds from a background thread
+    # instead of from the commands themselves
+    refresh_in_background: bool = False
+    # Record command, traffic and backend metrics in self.metrics
+    collect_metrics: bool = False
+    # If set, self.metrics are written to this file in the Prometheus text
+    # format every metrics_interval seconds, see export_metrics()
+    metrics_textfile: typing.Optional[str] = None
+    metrics_interval: float = 15.0
+    # Connections over these limits are answered with 400 and closed
+    max_connections: typing.Optional[int] = None
+    max_connections_per_ip: typing.Optional[int] = None
+    # Seconds to wait for the next command before closing the connection
+    idle_timeout: typing.Optional[float] = None
+    # Seconds to wait for more data of a partially received command line or
+    # POST article
+    command_timeout: typing.Optional[float] = 60.0
+    # Seconds a client may take to accept more response data before the
+    # connection is dropped
+    write_timeout: typing.Optional[float] = 60.0
+    # Seconds a client may take to complete the TLS handshake
+    handshake_timeout: typing.Optional[float] = 10.0
+    # Application protocols offered with ALPN on TLS connections
+    tls_alpn_protocols: typing.List[str] = ["nntp"]
+    # Number of TLS 1.3 session tickets issued after a full handshake, which
+    # let reconnecting clients resume the session without a key exchange
+    tls_session_tickets: int = 2
+
+    def __init__(
+        self,
+        *args: typing.Any,
+        auth: NNTPAuthSetting = NNTPAuthSetting.NOAUTH,
+        can_post: NNTPPostSetting = NNTPPostSetting.NOPOST,
+        use_ssl: bool = False,
+        starttls: bool = False,
+        certfile: typing.Optional[str] = None,
+        keyfile: typing.Optional[str] = None,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.auth = auth
+        self.certfile = certfile
+        self.keyfile = keyfile
+        # Whether connections start with a TLS handshake (e.g. port 563), as
+        # opposed to plain connections upgraded with STARTTLS
+        self.use_ssl = use_ssl
+        self.ssl_context: typing.Optional["ssl.SSLContext"] = None
+        self.can_post = can_post
+        self.overview_cache: LRUCache[typing.Tuple[int, str], bytes] = LRUCache(
+            self.overview_cache_size
+        )
+        self.body_cache: LRUCache[typing.Tuple[int, str], bytes] = LRUCache(
+            self.body_cache_size, len
+        )
+        self.metrics: typing.Optional[Metrics] = (
+            Metrics() if self.collect_metrics else None
+        )
+        self.refresh_scheduler = RefreshScheduler(
+            self.refresh,
+            self.refresh_interval,
+            self.refresh_in_background,
+            self.metrics,
+        )
+        self.connection_limiter = ConnectionLimiter(
+            self.max_connections, self.max_connections_per_ip
+        )
+        self._warm_up_thread: typing.Optional[threading.Thread] = None
+        self._metrics_thread: typing.Optional[threading.Thread] = None
+        self._metrics_stop = threading.Event()
+        self._active_file: typing.Optional[ActiveFile] = None
+        self._sighup_installed = False
+        if use_ssl or starttls:
+            if not certfile or not keyfile:
+                raise ValueError(
+                    "You must provide certfile and keyfile keyword arguments in NNTPServer.__init__ when use_ssl or starttls is True."
+                )
+            if not _have_ssl:
+                raise ValueError(
+                    "You set use_ssl or starttls to True but the ssl module could not be imported."
+                )
+            self.ssl_context = self.create_ssl_context()
+        if self.debugging:
+            _logger.setLevel(logging.DEBUG)
+        super().__init__(*args, **kwargs)
+
+    @abc.abstractmethod
+    def refresh(self) -> None:
+        """Hook for refreshing internal state before processing article/group commands
+
+        It is called through self.refresh_scheduler, see refresh_interval and
+        refresh_in_background."""
+        ...
+
+    @property
+    @abc.abstractmethod
+    def groups(self) -> typing.Dict[str, NNTPGroup]:
+        ...
+
+    @property
+    @abc.abstractmethod
+    def articles(self) -> typing.Dict[typing.Union[int, str], ArticleInfo]:
+        ...
+
+    @abc.abstractmethod
+    def article(self, key: typing.Union[str, int]) -> Article:
+        ...
+
+    def warm_up(self) -> None:
+        """Hook called once from a background thread after the server starts
+        accepting connections.
+
+        Load large indexes and caches here instead of in __init__, so that
+        startup time does not depend on the size of the archive. See
+        LazyArticleNumberIndex."""
+        pass
+
+    def start_warm_up(
+        self, resolve: typing.Callable[[typing.Any], typing.Any] = _identity
+    ) -> None:
+        """Run warm_up() in a daemon thread, unless it was already started."""
+        if self._warm_up_thread is not None:
+            return
+
+        # warm_up() may be a coroutine in backends of AsyncNNTPServer
+        warm_up: typing.Callable[[], typing.Any] = self.warm_up
+
+        def run() -> None:
+            start = time.perf_counter()
+            try:
+                resolve(warm_up())
+            except Exception:
+                _logger.exception("Background warm-up failed")
+            if self.metrics is not None:
+                self.metrics.observe_backend("warm_up", time.perf_counter() - start)
+
+        self._warm_up_thread = threading.Thread(
+            target=run, name="nntp-warm-up", daemon=True
+        )
+        self._warm_up_thread.start()
+
+    def export_metrics(self) -> None:
+        """Called every metrics_interval seconds from a background thread
+        when metrics are collected.
+
+        Writes self.metrics to metrics_textfile, if set; override to export
+        them elsewhere."""
+        if self.metrics is not None and self.metrics_textfile is not None:
+            self.metrics.write_textfile(self.metrics_textfile)
+
+    def start_metrics_export(self) -> None:
+        """Start calling export_metrics() periodically, if metrics are
+        collected."""
+        if self.metrics is None or self._metrics_thread is not None:
+            return
+
+        def run() -> None:
+            while not self._metrics_stop.wait(self.metrics_interval):
+                try:
+                    self.export_metrics()
+                except Exception:
+                    _logger.exception("Metrics export failed")
+
+        self._metrics_stop.clear()
+        self._metrics_thread = threading.Thread(
+            target=run, name="nntp-metrics", daemon=True
+        )
+        self._metrics_thread.start()
+
+    def stop_metrics_export(self) -> None:
+        self._metrics_stop.set()
+        thread, self._metrics_thread = self._metrics_thread, None
+        if thread is not None:
+            thread.join()
+            self.export_metrics()
+
+    def admit(self, client_address: typing.Any) -> typing.Optional[bytes]:
+        """Count a new connection against the connection limits.
+
+        Returns None if the connection is accepted, and otherwise the 400
+        response to send before closing it. Accepted connections must be
+        released with self.connection_limiter.release()."""
+        reason = self.connection_limiter.acquire(_address_key(client_address))
+        if reason is None:
+            return None
+        _logger.info("Refused connection from %s: %s.", client_address, reason)
+        if self.metrics is not None:
+            self.metrics.connection_rejected()
+        return f"400 {reason}, try again later".encode("utf-8") + _CRLF
+
+    def create_ssl_context(self) -> "ssl.SSLContext":
+        """Return a server TLS context for certfile and keyfile.
+
+        It is created once and shared by all connections, so that the
+        certificate is not parsed per connection and sessions can be resumed
+        from the context's session cache or with session tickets."""
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(typing.cast(str, self.certfile), keyfile=self.keyfile)
+        context.options &= ~ssl.OP_NO_TICKET
+        if hasattr(context, "num_tickets"):
+            context.num_tickets = self.tls_session_tickets
+        if self.tls_alpn_protocols and ssl.HAS_ALPN:
+            context.set_alpn_protocols(self.tls_alpn_protocols)
+        context.sni_callback = self._select_ssl_context
+        return context
+
+    def reload_ssl_context(self) -> None:
+        """Load certfile and keyfile again, e.g. after the certificate was
+        renewed. New handshakes use the new certificate, established
+        connections are not affected.
+
+        Servers call this on SIGHUP if they run in the main thread and no
+        other SIGHUP handler is installed."""
+        if self.ssl_context is None:
+            return
+        try:
+            self.ssl_context = self.create_ssl_context()
+        except (OSError, ValueError):
+            _logger.exception("Could not reload the TLS certificate")
+            return
+        _logger.info("Reloaded TLS certificate %s.", self.certfile)
+
+    def _select_ssl_context(
+        self,
+        ssl_object: typing.Any,
+        server_name: typing.Optional[str],
+        context: typing.Any,
+    ) -> None:
+        # Listening sockets and asyncio servers keep the context they were
+        # created with; switching here applies reloaded certificates to them.
+        current = self.ssl_context
+        if current is not None and context is not current:
+            ssl_object.context = current
+
+    def _install_sighup(self) -> None:
+        """Call reload_ssl_context() on SIGHUP, unless SIGHUP is already
+        handled (e.g. ignored by PreforkLauncher workers)."""
+        if (
+            self.ssl_context is None
+            or not hasattr(signal, "SIGHUP")
+            or threading.current_thread() is not threading.main_thread()
+            or signal.getsignal(signal.SIGHUP) != signal.SIG_DFL
+        ):
+            return
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_ssl_context())
+        self._sighup_installed = True
+
+    def _uninstall_sighup(self) -> None:
+        if self._sighup_installed:
+            self._sighup_installed = False
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    def stats_permitted(self, auth_token: typing.Optional[bytes]) -> bool:
+        """Whether a client authenticated with auth_token (None if it is not
+        authenticated) may read the server metrics with XSTATS."""
+        return auth_token is not None
+
+    def hdr_range(
+        self, group: NNTPGroup, low: int, high: int, field: str
+    ) -> typing.Optional[typing.Iterable[typing.Tuple[int, str]]]:
+        """Return (number, value) of field for the existing articles of group
+        numbered from low to high, in ascending order, as HDR sends them (see
+        header_accessor()).
+
+        Backends that store headers by column should implement this; the
+        default reads the column of an ArticleStore returned by
+        group.articles. If it returns None, HDR gets the articles from
+        iter_range() or self.articles instead."""
+        articles = group.articles
+        if isinstance(articles, ArticleStore):
+            return articles.header(low, high, field)
+        return None
+
+    def active_version(self) -> typing.Hashable:
+        """Return a value that changes whenever groups are added or removed,
+        or their watermarks, posting status or descriptions change.
+
+        The default reads these properties of every group on each LIST, so
+        that only formatting the lines is saved. Backends should override it
+        to return a counter they increment when their groups change, which
+        makes LIST independent of the number of groups until they do."""
+        return tuple(
+            (g.name, g.high, g.low, g.posting_permitted, g.short_description)
+            for g in self.groups.values()
+        )
+
+    def active_file(self) -> ActiveFile:
+        """Return the snapshot of self.groups served by LIST ACTIVE and LIST
+        NEWSGROUPS, rebuilt when active_version() changes."""
+        version = self.active_version()
+        snapshot = self._active_file
+        if snapshot is None or snapshot.version != version:
+            snapshot = self._active_file = ActiveFile(self.groups.values(), version)
+        return snapshot
+
+    def iter_range(
+        self, group: NNTPGroup, low: int, high: int
+    ) -> typing.Optional[typing.Iterable[ArticleInfo]]:
+        """Return the existing articles of group numbered from low to high
+        (inclusive) in ascending order.
+
+        Backends with an ordered index (e.g. SQL) should implement this; if it
+        returns None, every number in the range is looked up in self.articles
+        instead."""
+        return None
+
+    def overview_line(self, info: ArticleInfo) -> bytes:
+        """Return the CRLF terminated overview line of info as sent by OVER.
+
+        Articles do not change once numbered, so lines are cached by number
+        and message-id. Call self.overview_cache.clear() if they do."""
+        key = (info.number, info.message_id)
+        line = self.overview_cache.get(key)
+        if line is None:
+            line = _encode_overview(info)
+            self.overview_cache.put(key, line)
+        return line
+
+    def body_wire(self, article: Article) -> bytes:
+        """Return the body of article in wire form, see encode_body().
+
+        Uses article.wire_body when the backend provides it, and otherwise
+        caches the encoded body by number and message-id."""
+        if article.wire_body is not None:
+            return article.wire_body
+        key = (article.info.number, article.info.message_id)
+        wire = self.body_cache.get(key)
+        if wire is None:
+            wire = encode_body(article.body)
+            self.body_cache.put(key, wire)
+        return wire
+
+    def article_spool(self, article: Article) -> typing.Optional[typing.BinaryIO]:
+        """Return an open binary file with the body of article in wire form
+        (see encode_body()) to send it with sendfile(), or None to send
+        body_wire(article) instead. The file is closed after sending."""
+        return None
+
+    def date(self) -> datetime.datetime:
+        return datetime.datetime.utcnow()
+
+    def newnews(
+        self, wildmat: str, date: datetime.datetime
+    ) -> typing.Optional[typing.Iterator[ArticleInfo]]:
+        return None
+
+    def newgroups(
+        self, date: datetime.datetime
+    ) -> typing.Optional[typing.List[NNTPGroup]]:
+        return None
+
+    @property
+    def debugging(self) -> bool:
+        """If True, set the "nntpserver" logger to DEBUG to trace every line
+        received and sent. Configuring the logger has the same effect."""
+        return False
+
+    def auth_user(self, user: str, password: str) -> bytes:
+        """Return an auth token on success. This token will be passed to the server for authenticated actions like POSTing articles."""
+        raise NNTPAuthenticationError("Authentication not supported")
+
+    def post(self, auth_token: typing.Optional[bytes], lines: str) -> None:
+        raise NNTPPostError("Posting not supported")
+
+    @property
+    def subscriptions(self) -> typing.Optional[typing.List[str]]:
+        return None
+
+    @property
+    def help(self) -> typing.Optional[str]:
+        """Return an informational help text to the user. If None, a generic message will be generated."""
+        return None
+
+
+def _address_key(client_address: typing.Any) -> str:
+    """Return the client IP address of a socket address (or the address
+    itself for other families), as counted by ConnectionLimiter."""
+    if isinstance(client_address, tuple):
+        return str(client_address[0])
+    return str(client_address)
+
+
+def _is_tls_socket(request: typing.Any) -> bool:
+    return _have_ssl and isinstance(request, ssl.SSLSocket)
+
+
+class NNTPServer(NNTPBackend, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self.refresh_scheduler.start()
+        self.start_warm_up()
+        self.start_metrics_export()
+        self._install_sighup()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._uninstall_sighup()
+            self.refresh_scheduler.stop()
+            self.stop_metrics_export()
+
+    def get_request(self) -> typing.Tuple[typing.Any, typing.Tuple[str, int]]:
+        newsocket, fromaddr = self.socket.accept()
+        # Responses are already coalesced in the handler's output buffer, and
+        # with Nagle's algorithm the greeting sent after the TLS session
+        # tickets would wait for a delayed ACK (asyncio disables it too).
+        try:
+            newsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        if self.use_ssl and self.ssl_context is not None:
+            # The handshake is done by the connection handler, so that a slow
+            # client does not hold up accepting other connections.
+            connstream = self.ssl_context.wrap_socket(
+                newsocket, server_side=True, do_handshake_on_connect=False
+            )
+            return connstream, fromaddr
+        return newsocket, fromaddr
+
+    def process_request(self, request: typing.Any, client_address: typing.Any) -> None:
+        refusal = self.admit(client_address)
+        if refusal is not None:
+            # Refused connections never get a thread. TLS connections are
+            # closed without a response, which would need a handshake first.
+            if not _is_tls_socket(request):
+                try:
+                    request.settimeout(1.0)
+                    request.sendall(refusal)
+                except OSError:
+                    pass
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.connection_limiter.release(_address_key(client_address))
+            raise
+
+    def process_request_thread(
+        self, request: typing.Any, client_address: typing.Any
+    ) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_limiter.release(_address_key(client_address))
+
+
+if typing.TYPE_CHECKING:
+
+    class _HandlerServer(NNTPBackend, socketserver.BaseServer):
+        """The type of NNTPConnectionHandler.server: a backend, which is also
+        a BaseServer except in AsyncNNTPServer."""
+
+
+class NNTPConnectionHandler(socketserver.BaseRequestHandler):
+    """
+    The request handler class for our server.
+
+    It is instantiated once per connection to the server, and must
+    override the handle() method to implement communication to the
+    client.
+    """
+
+    server: "_HandlerServer"
+    write_high_water: int = _WRITE_HIGH_WATER
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        self._init_state()
+        super().__init__(*args, **kwargs)
+
+    def setup(self) -> None:
+        _logger.info("New connection from %s.", self.client_address)
+        if self.server.metrics is not None:
+            self.server.metrics.connection_opened()
+
+    def finish(self) -> None:
+        if self.server.metrics is not None:
+            self.server.metrics.connection_closed()
+        if self._upgraded:
+            # socketserver closes the socket it accepted, which STARTTLS
+            # replaced.
+            self.server.shutdown_request(self.request)  # type: ignore[attr-defined]
+
+    def _init_state(self) -> None:
+        # self.command_queue = collections.deque()
+        self.command_history: typing.List[str] = []
+        self._init: bool = True
+        self._quit: bool = False
+        self._authed: bool = False
+        self._auth_token: typing.Optional[bytes] = None
+        self._authed_user: typing.Optional[str] = None
+        # Whether the connection is encrypted, and whether that is due to
+        # STARTTLS
+        self._tls: bool = False
+        self._upgraded: bool = False
+        # Received bytes; self._buffer[self._rpos:] is not consumed yet and
+        # holds no newline before self._scan.
+        self._buffer: bytearray = bytearray()
+        self._rpos: int = 0
+        self._scan: int = 0
+        self._wbuf: bytearray = bytearray()
+        # Whether the next read waits for a new command rather than for the
+        # rest of one, see _read_timeout()
+        self._idle: bool = False
+        # The timeout currently set on self.request
+        self._socket_timeout: typing.Any = ()
+        self.current_selected_newsgroup: typing.Optional[str] = None
+        self.current_article_number: typing.Optional[int] = None
+
+    def _resolve(self, value: typing.Any) -> typing.Any:
+        """Return the result of a backend hook call.
+
+        Backends used with AsyncNNTPServer may implement hooks as coroutines;
+        the threaded handler only supports plain return values.
+        """
+        return value
+
+    def greet(self) -> None:
+        if self.server.can_post:
+            self.send_lines(["200 NNTP Service Ready, posting allowed"])
+        else:
+            self.send_lines(["201 NNTP Service Ready, posting prohibited"])
+
+    def handshake(self) -> bool:
+        """Complete the TLS handshake of a connection accepted on a TLS
+        socket. Returns whether the connection can be used."""
+        if not _is_tls_socket(self.request):
+            return True
+        self._settimeout(self.server.handshake_timeout)
+        try:
+            self.request.do_handshake()
+        except (OSError, ValueError) as exc:
+            _logger.info("TLS handshake with %s failed: %s", self.client_address, exc)
+            return False
+        self._tls = True
+        return True
+
+    def handle(self) -> None:
+        if self._quit:
+            raise Exception("QUIT??")
+        if self._init:
+            if not self.handshake():
+                return
+            self.greet()
+            self._init = False
+        # self.request is the TCP socket connected to the client
+        try:
+            while not self._quit:
+                try:
+                    self._idle = True
+                    self.data = self._getline()
+                    self._idle = False
+                except NNTPDataError as exc:
+                    _logger.warning(
+                        "Data error from %s: %s", self.client_address, exc
+                    )
+                    self._quit = True
+                    self.send_lines(["205 Connection closing"])
+                    break
+                except EOFError:
+                    break
+                self.process_command()
+                # Responses to pipelined commands are coalesced until the
+                # client has to be waited on.
+                if not self._has_pending_command():
+                    self.flush()
+            self.flush()
+        except EOFError:
+            pass
+        except NNTPTimeoutError as exc:
+            self._timed_out(exc)
+        except socket.timeout:
+            _logger.info("Write timeout, dropping %s.", self.client_address)
+
+    def _timed_out(self, exc: NNTPTimeoutError) -> None:
+        """Tell a client that did not send anything in time that the
+        connection is closing."""
+        _logger.info("%s: %s.", self.client_address, exc)
+        self._quit = True
+        if self._init:
+            # Still in the TLS handshake; there is no channel to answer on.
+            return
+        self._wbuf.clear()
+        self.send_lines(["400 Timeout, closing connection"])
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def _read_timeout(self) -> typing.Optional[float]:
+        """Return idle_timeout when waiting for a new command, and
+        command_timeout when part of a command has been received."""
+        if self._idle and self._rpos == len(self._buffer):
+            return self.server.idle_timeout
+        return self.server.command_timeout
+
+    def _settimeout(self, timeout: typing.Optional[float]) -> None:
+        # Switching between blocking and timeout mode costs system calls, so
+        # the socket is only updated when the timeout changes.
+        if timeout != self._socket_timeout:
+            self.request.settimeout(timeout)
+            self._socket_timeout = timeout
+
+    # Maps the casefolded first word of a command line to the name of the
+    # handler method, or to a function taking the handler. Use
+    # register_command() to add or override commands in a subclass.
+    commands: typing.Dict[
+        str, typing.Union[str, typing.Callable[["NNTPConnectionHandler"], None]]
+    ] = {
+        "article": "article",
+        "authinfo": "auth",
+        "body": "body",
+        "capabilities": "capabilities",
+        "date": "date",
+        "group": "group",
+        "hdr": "hdr",
+        "head": "head",
+        "help": "help",
+        "last": "last",
+        "list": "list",
+        "listgroup": "listgroup",
+        "mode": "mode",
+        "newgroups": "newgroups",
+        "newnews": "newnews",
+        "next": "next",
+        "over": "overview",
+        "post": "post",
+        "quit": "quit",
+        "starttls": "starttls",
+        "stat": "stat",
+        "xhdr": "hdr",
+        "xover": "overview",
+        "xstats": "stats",
+    }
+
+    @classmethod
+    def register_command(
+        cls,
+        verb: str,
+        handler: typing.Union[str, typing.Callable[["NNTPConnectionHandler"], None]],
+    ) -> None:
+        """Make verb dispatch to handler in this class and its subclasses.
+
+        handler is a method name or a function taking the connection handler,
+        which can read the full command line from self.data."""
+        if "commands" not in cls.__dict__:
+            cls.commands = dict(cls.commands)
+        cls.commands[verb.casefold()] = handler
+
+    def process_command(self) -> None:
+        """Execute the command line stored in self.data."""
+        words = self.data.split(None, 1)
+        if not words:
+            return
+        verb = words[0].casefold()
+        if verb != "authinfo" and _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("got: %s", self.data)
+        handler = self.commands.get(verb)
+        if handler is None:
+            self.send_lines(["500 Unknown command"])
+            return
+        metrics = self.server.metrics
+        try:
+            if metrics is None:
+                if isinstance(handler, str):
+                    getattr(self, handler)()
+                else:
+                    handler(self)
+            else:
+                start = time.perf_counter()
+                failed = True
+                try:
+                    if isinstance(handler, str):
+                        getattr(self, handler)()
+                    else:
+                        handler(self)
+                    failed = False
+                finally:
+                    metrics.observe_command(verb, time.perf_counter() - start, failed)
+        except OSError:
+            raise
+        except Exception:
+            # Responses coalesced for earlier pipelined commands would be
+            # lost with the connection, so send them before the error
+            # propagates, as unbuffered writes would have.
+            try:
+                self.flush()
+            except OSError:
+                pass
+            raise
+        if not self._quit:
+            self.command_history.append(self.data)
+
+    def post(self) -> None:
+        allow = False
+        if self.server.can_post and not (
+            self.server.can_post & NNTPPostSetting.AUTHREQUIRED
+        ):
+            allow = True
+        elif self._authed and (self.server.can_post & NNTPPostSetting.AUTHREQUIRED):
+            allow = True
+        elif not self._authed or not self.server.can_post:
+            pass
+        elif not self._authed and (
+            self.server.can_post & NNTPPostSetting.AUTHREQUIRED
+        ):
+            pass
+        if not allow:
+            self.send_lines(["440 Posting not permitted"])
+            return
+        self.send_lines(["340 Input article; end with <CR-LF>.<CR-LF>"])
+        self._post_article()
+
+    def _post_article(self) -> None:
+        """Receive the article of a POST command and pass it to the backend."""
+        try:
+            lines = self._getlines()
+            # post() may be a coroutine in backends of AsyncNNTPServer
+            post: typing.Callable[..., typing.Any] = self.server.post
+            self._resolve(post(self._auth_token, lines))
+            self.send_lines(["240 Article received OK"])
+        except NNTPDataError as exc:
+            _logger.warning("Data error from %s: %s", self.client_address, exc)
+            self._quit = True
+            self.send_lines(["205 Connection closing"])
+        except NNTPPostError as exc:
+            self.send_lines([f"441 Posting failed: {exc.response}"])
+
+    def group(self) -> None:
+        command, *tokens = self.data.split()
+        if len(tokens) != 1:
+            self.send_lines(["501 Syntax Error"])
+            return
+        self.select_group(tokens[0])
+
+    def body(self) -> None:
+        self.article(body=True)
+
+    def mode(self) -> None:
+        command, *tokens = self.data.split()
+        if len(tokens) != 1 or tokens[0].casefold() != "reader":
+            self.send_lines(["501 Syntax Error"])
+            return
+        self.greet()
+
+    def date(self) -> None:
+        date = self.server.date()
+        self.send_lines([f"111 {''.join(format_datetime(date))}"])
+
+    def quit(self) -> None:
+        self._quit = True
+        self.send_lines(["205 Connection closing"])
+
+    AUTHINFO_RE = re.compile(
+        r"^authinfo\s*(?P<keyword>(?:pass)|(?:user))\s*(?P<value>.*)$",
+        re.IGNORECASE,
+    )
+
+    def auth(self) -> None:
+        self.server.refresh_scheduler.request(self._resolve)
+        # Don't use .split() because password may contain white spaces
+        match = self.AUTHINFO_RE.search(self.data.strip())
+        if not match:
+            self.send_lines(["501 Syntax Error"])
+            return
+        keyword = match.group("keyword").casefold()
+        value = match.group("value")
+        if not self.server.auth or self._authed:
+            self.send_lines(["502 Command unavailable"])
+            return
+        if self.server.auth & NNTPAuthSetting.SECUREONLY and not self._tls:
+            self.send_lines(["483 Encryption required"])
+            return
+        if keyword == "user":
+            self._authed_user = value
+            self.send_lines(["381 Enter passphrase"])
+            return
+
+        if not self._authed_user:
+            self.send_lines(["482 Authentication commands issued out of sequence"])
+            return
+
+        try:
+            self._auth_token = self._resolve(
+                self.server.auth_user(self._authed_user, value)
             )
-        self.send_lines(["230 list of new articles by message-id follows"])
-        for article in articles:
-            self.send_lines([article.message_id])
-        self.send_lines(["."])
+            self.send_lines([f"281 Authentication accepted"])
+            self._authed = True
+        except NNTPAuthenticationError as exc:
+            self.send_lines([f"481 {exc.response}"])
+
+    def capabilities(self) -> None:
+        show_auth = False
+        if not self._authed and self.server.auth:
+            if (self.server.auth & NNTPAuthSetting.SECUREONLY) and not self._tls:
+                pass
+            else:
+                show_auth = True
+
+        capabilities = [
+            "VERSION 2",
+            "READER",
+            "HDR",
+            "NEWNEWS",
+            "LIST ACTIVE NEWSGROUPS OVERVIEW.FMT SUBSCRIPTIONS",
+            "OVER MSGID",
+            # Commands may be pipelined (RFC 3977 section 3.5); responses to
+            # pipelined commands are sent together.
+            "XPIPELINING",
+        ]
+        if self.server.can_post:
+            capabilities.append("POST")
+        if self._starttls_available():
+            capabilities.append("STARTTLS")
+        if show_auth:
+            capabilities.append("AUTHINFO USER")
+        if self.server.metrics is not None:
+            capabilities.append("XSTATS")
+        self.send_multiline("101 Capability list:", capabilities)
+
+    def _starttls_available(self) -> bool:
+        return (
+            self.server.ssl_context is not None and not self._tls and not self._authed
+        )
+
+    def starttls(self) -> None:
+        """STARTTLS (RFC 4642): negotiate TLS on a plain connection."""
+        context = self.server.ssl_context
+        if self._tls or self._authed:
+            self.send_lines(["502 Command unavailable"])
+            return
+        if context is None or not self._starttls_available():
+            self.send_lines(["580 Can not initiate TLS negotiation"])
+            return
+        self.send_lines(["382 Continue with TLS negotiation"])
+        # Commands sent after STARTTLS were not protected and are discarded.
+        self._buffer.clear()
+        self._rpos = self._scan = 0
+        try:
+            self._start_tls(context)
+        except (OSError, ValueError) as exc:
+            _logger.info("TLS handshake with %s failed: %s", self.client_address, exc)
+            self._quit = True
+            return
+        self._tls = True
+        self._upgraded = True
+        # Nothing learned from the client before the handshake is kept.
+        self._authed_user = None
+
+    def _start_tls(self, context: "ssl.SSLContext") -> None:
+        """Send the queued 382 response and do the TLS handshake."""
+        self.flush()
+        self._settimeout(self.server.handshake_timeout)
+        self.request = context.wrap_socket(self.request, server_side=True)
+        self._socket_timeout = self.request.gettimeout()
+
+    def stats(self) -> None:
+        """XSTATS [PROMETHEUS]: send a summary of the server metrics, or all
+        of them in the Prometheus text format."""
+        metrics = self.server.metrics
+        if metrics is None:
+            self.send_lines(["500 Unknown command"])
+            return
+        if not self.server.stats_permitted(self._auth_token):
+            self.send_lines(["502 Permission denied"])
+            return
+        command, *tokens = self.data.split()
+        if not tokens:
+            self.send_multiline("290 Statistics follow (multi-line)", metrics.summary())
+        elif tokens[0].casefold() == "prometheus":
+            self.send_multiline(
+                "290 Statistics follow (multi-line)", metrics.render().splitlines()
+            )
+        else:
+            self.send_lines(["501 Syntax Error"])
+
+    def newnews(self) -> None:
+        self.server.refresh_scheduler.request(self._resolve)
+        command, *tokens = self.data.strip().split()
+        if len(tokens) < 2:
+            self.send_lines(["501 Syntax Error"])
+            return
+        wildmat, date_str, time_str, *gmt = tokens
+        try:
+            date = parse_datetime(date_str, time_str=time_str)
+            compile_wildmat(wildmat)
+        except (TypeError, ValueError):
+            self.send_lines(["501 Syntax Error"])
+            return
+        # Check if server implements newnews, otherwise compute newnews on our own.
+        articles = self._resolve(self.server.newnews(wildmat, date))
+        if articles is None:
+            self.send_multiline(
+                "230 list of new articles by message-id follows",
+                self._new_message_ids(wildmat, date),
+            )
+            return
+        self.send_multiline(
+            "230 list of new articles by message-id follows",
+            (article.message_id for article in articles),
+        )
+
+    def _new_message_ids(
+        self, wildmat: str, date: datetime.datetime
+    ) -> typing.Iterator[str]:
+        """Yield the message-ids of the articles that arrived since date in
+        the groups matching wildmat, each once."""
+        matches = compile_wildmat(wildmat)
+        groups = [g for g in self.server.groups.values() if matches(g.name)]
+        # Crossposted articles appear in several groups.
+        seen: typing.Optional[typing.Set[str]] = set() if len(groups) > 1 else None
+        for group in groups:
+            arrivals = group.arrivals
+            message_ids: typing.Iterable[str]
+            if arrivals is not None:
+                message_ids = arrivals.since(date)
+            else:
+                message_ids = (
+                    a.message_id for a in group.articles.values() if a.date >= date
+                )
+            for message_id in message_ids:
+                if seen is not None:
+                    if message_id in seen:
+                        continue
+                    seen.add(message_id)
+                yield message_id
 
     def newgroups(self) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.strip().split()
         if len(tokens) < 2:
             self.send_lines(["501 Syntax Error"])
@@ -569,7 +2620,7 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             self.send_lines(["501 Syntax Error"])
             return
         # Check if server implements newgroups, otherwise compute newgroups on our own.
-        groups = self.server.newgroups(date)
+        groups = self._resolve(self.server.newgroups(date))
 
         if groups is not None:
             groups = typing.cast(typing.List[NNTPGroup], groups)
@@ -578,19 +2629,18 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                 filter(lambda g: g.created >= date, self.server.groups.values())
             )
 
-        self.send_lines(
-            ["231 list of new newsgroups follows"]
-            + [f"{g.name} {g.high} {g.low} n" for g in groups]
-            + ["."]
+        self.send_multiline(
+            "231 list of new newsgroups follows",
+            (f"{g.name} {g.high} {g.low} n" for g in groups),
         )
 
     def listgroup(self) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.strip().split()
-        if len(tokens) == 0 and self.current_selected_newsgroup is None:
+        group_name = tokens[0] if tokens else self.current_selected_newsgroup
+        if group_name is None:
             self.send_lines(["412 No newsgroups selected"])
             return
-        group_name = tokens[0]
         if group_name != self.current_selected_newsgroup:
             if not self.select_group(group_name):
                 return
@@ -603,177 +2653,390 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             range_ = (group.low, group.high)
         if not range_[1]:
             range_ = (range_[0], group.high)
-        ret = [f"211 {group.number} {group.low} {group.high} {group.name}"]
-        for i in range(range_[0], typing.cast(int, range_[1]) + 1):
-            try:
-                _articleinfo = self.server.articles[i]
-                ret.append(str(i))
-            except NNTPArticleNotFound:
-                pass
-        ret.append(".")
-        self.send_lines(ret)
+        overview = self._overview_file()
+        if overview is not None:
+            self.send_multiline(
+                f"211 {group.number} {group.low} {group.high} {group.name}",
+                (
+                    b"%d\r\n" % number
+                    for number in overview.numbers(
+                        range_[0], typing.cast(int, range_[1])
+                    )
+                ),
+            )
+            return
+        self.send_multiline(
+            f"211 {group.number} {group.low} {group.high} {group.name}",
+            (
+                str(articleinfo.number)
+                for articleinfo in self._articles_in_range(
+                    range_[0], typing.cast(int, range_[1])
+                )
+            ),
+        )
 
     def list(self) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.strip().split()
         keyword = tokens[0] if len(tokens) != 0 else None
         argument = tokens[1] if len(tokens) > 1 else None
-        wildmat = tokens[2] if len(tokens) > 2 else None
+        if len(tokens) > 2:
+            self.send_lines(["501 Syntax Error"])
+            return
+        if argument is not None:
+            try:
+                compile_wildmat(argument)
+            except ValueError:
+                self.send_lines(["501 Syntax Error"])
+                return
 
         if keyword is None or keyword.casefold() == "active":
-            if argument is None and wildmat is None:
-                self.send_lines(
-                    ["215 list of newsgroups follows"]
-                    + [
-                        f"{g.name} {g.high} {g.low} {g.posting_permitted}"
-                        for g in self.server.groups.values()
-                    ]
-                    + ["."]
-                )
-                return
-            if wildmat is None:
-                self.send_lines(
-                    ["215 list of newsgroups follows"]
-                    + [
-                        f"{g.name} {g.high} {g.low} {g.posting_permitted}"
-                        for g in filter(
-                            lambda g: g.name == argument, self.server.groups.values()
-                        )
-                    ]
-                    + ["."]
-                )
-                return
+            self._send_block(
+                "215 list of newsgroups follows",
+                self.server.active_file().active(argument),
+            )
+            return
 
-        if keyword and keyword.casefold() == "newsgroups":
-            if argument is None and wildmat is None:
-                self.send_lines(
-                    ["215 list of newsgroups follows"]
-                    + [
-                        f"{g.name}\t{g.short_description}"
-                        for g in self.server.groups.values()
-                    ]
-                    + ["."]
-                )
-                return
-            if wildmat is None:
-                self.send_lines(
-                    ["215 list of newsgroups follows"]
-                    + [
-                        f"{g.name} {g.high} {g.low} {g.posting_permitted}"
-                        for g in filter(
-                            lambda g: g.name == argument, self.server.groups.values()
-                        )
-                    ]
-                    + ["."]
-                )
-                return
+        if keyword.casefold() == "newsgroups":
+            self._send_block(
+                "215 list of newsgroups follows",
+                self.server.active_file().newsgroups(argument),
+            )
+            return
+
+        if keyword and keyword.casefold() == "subscriptions" and argument is None:
+            subs: typing.Optional[typing.List[str]] = self.server.subscriptions
+            if subs is None:
+                self.send_lines(["503 No list of recommended newsgroups available"])
+            else:
+                self.send_multiline("215 List of recommended newsgroups follows", subs)
+            return
+
+        if keyword and keyword.casefold() == "overview.fmt" and argument is None:
+            self.send_multiline(
+                "215 Order of fields in overview database.",
+                self.server.overview_format,
+            )
+            return
+
+        self.send_lines(["501 Syntax Error"])
+        return
+
+    def _articles_in_range(self, low: int, high: int) -> typing.Iterator[ArticleInfo]:
+        """Yield the existing articles of the selected group in [low, high]."""
+        group = self.server.groups[typing.cast(str, self.current_selected_newsgroup)]
+        articles = self._resolve(self.server.iter_range(group, low, high))
+        if articles is not None:
+            yield from articles
+            return
+        index = group.index
+        if index is not None:
+            numbers: typing.Iterable[int] = index.range(low, high)
+        else:
+            # Numbers outside the group's watermarks cannot exist.
+            numbers = range(max(low, group.low), min(high, group.high) + 1)
+        for i in numbers:
+            try:
+                yield self.server.articles[i]
+            except NNTPArticleNotFound:
+                pass
+
+    def _overview_file(self) -> typing.Optional[OverviewFile]:
+        """Return the overview database file of the selected group, if any."""
+        if self.server.overview_db is None or self.current_selected_newsgroup is None:
+            return None
+        return self.server.overview_db.get(self.current_selected_newsgroup)
+
+    def _locate_message_id(
+        self, message_id: str
+    ) -> typing.Optional[typing.Tuple[str, int]]:
+        """Return the (group name, number) of message_id from
+        self.server.message_ids, or None if it is not indexed there."""
+        index = self.server.message_ids
+        if index is None:
+            return None
+        return index.get(message_id)
+
+    def _articleinfo_by_id(self, message_id: str) -> ArticleInfo:
+        location = self._locate_message_id(message_id)
+        if location is not None:
+            # The index entry may be stale, e.g. for an expired article.
+            group, number = location
+            try:
+                info = self.server.groups[group].articles[number]
+            except (KeyError, NNTPArticleNotFound):
+                pass
+            else:
+                if info.message_id == message_id:
+                    return info
+        try:
+            return self.server.articles[message_id]
+        except KeyError:
+            raise NNTPArticleNotFound(message_id)
+
+    def _article_by_id(self, message_id: str) -> Article:
+        location = self._locate_message_id(message_id)
+        if location is not None:
+            # self.server.article() takes no group, so with per-group
+            # numbering the number may belong to an article of another group.
+            try:
+                article = self._resolve(self.server.article(location[1]))
+            except (KeyError, NNTPArticleNotFound):
+                pass
+            else:
+                if article.info.message_id == message_id:
+                    return article
+        return self._resolve(self.server.article(message_id))
+
+    def _neighbour(self, step: int) -> typing.Optional[ArticleInfo]:
+        """Return the closest existing article after (step=1) or before
+        (step=-1) the current article."""
+        group = self.server.groups[typing.cast(str, self.current_selected_newsgroup)]
+        current = typing.cast(int, self.current_article_number)
+        index = group.index
+        if index is not None:
+            while True:
+                number = index.next(current) if step > 0 else index.previous(current)
+                if number is None:
+                    return None
+                try:
+                    return self.server.articles[number]
+                except NNTPArticleNotFound:
+                    current = number
+        stop = group.high + 1 if step > 0 else group.low - 1
+        for number in range(current + step, stop, step):
+            try:
+                return self.server.articles[number]
+            except NNTPArticleNotFound:
+                pass
+        return None
+
+    def next(self) -> None:
+        self._move(1, "421 No next article in this group")
+
+    def last(self) -> None:
+        self._move(-1, "422 No previous article in this group")
+
+    def _move(self, step: int, not_found: str) -> None:
+        self.server.refresh_scheduler.request(self._resolve)
+        if self.current_selected_newsgroup is None:
+            self.send_lines(["412 No newsgroup selected"])
+            return
+        if self.current_article_number is None:
+            self.send_lines(["420 Current article number is invalid"])
+            return
+        article = self._neighbour(step)
+        if article is None:
+            self.send_lines([not_found])
+            return
+        self.current_article_number = article.number
+        self.send_lines([f"223 {article.number} {article.message_id}"])
+
+    def select_group(self, group_name: str) -> bool:
+        self.server.refresh_scheduler.request(self._resolve)
+        _logger.debug("Group name %s", group_name)
+        if group_name in self.server.groups:
+            self.current_selected_newsgroup = group_name
+            group = self.server.groups[group_name]
+            if group.number == 0:
+                self.current_article_number = None
+            else:
+                self.current_article_number = group.low
+            self.send_lines(
+                [f"211 {group.number} {group.low} {group.high} {group.name}"]
+            )
+            return True
+        self.send_lines(["411 No such newsgroup"])
+        return False
+
+    def send_lines(self, lines: typing.List[str]) -> None:
+        """Queue response lines in the output buffer.
+
+        Lines are written to the socket when the buffer reaches
+        write_high_water bytes or on the next flush().
+        """
+        wbuf = self._wbuf
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        for line in lines:
+            if debug:
+                _logger.debug("sending %s", line)
+            wbuf += line.strip().encode("utf-8")
+            wbuf += _CRLF
+            if len(wbuf) >= self.write_high_water:
+                self.flush()
+
+    def send_multiline(
+        self, status: str, lines: typing.Iterable[typing.Union[str, bytes]]
+    ) -> None:
+        """Send a status line followed by a multi-line data block and its
+        terminating "." line.
+
+        lines is consumed lazily so responses of any size are sent with a
+        bounded buffer. str items are dot-stuffed and CRLF terminated here;
+        bytes items are written as they are and must already be in that wire
+        form.
+        """
+        self.send_lines([status])
+        wbuf = self._wbuf
+        high_water = self.write_high_water
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        for line in lines:
+            if isinstance(line, bytes):
+                if debug:
+                    _logger.debug(
+                        "sending %s", line.decode("utf-8", "replace").rstrip()
+                    )
+                wbuf += line
+            else:
+                if debug:
+                    _logger.debug("sending %s", line)
+                wbuf += _encode_line(line)
+            if len(wbuf) >= high_water:
+                self.flush()
+        self.send_lines(["."])
+
+    def _send_block(self, status: str, data: bytes) -> None:
+        """Send a status line followed by a multi-line data block that is
+        already in wire form, without its terminating "." line."""
+        self.send_lines([status])
+        if data:
+            self._write(data)
+        self.send_lines(["."])
+
+    def _write(self, data: typing.Union[bytes, memoryview]) -> None:
+        """Queue data that is already in wire form, sending large blocks
+        directly instead of copying them into the output buffer."""
+        _logger.debug("sending %d bytes", len(data))
+        if len(self._wbuf) + len(data) < self.write_high_water:
+            self._wbuf += data
+            return
+        self.flush()
+        self._send(data)
+
+    def _sendfile(self, file: typing.BinaryIO) -> None:
+        self._settimeout(self.server.write_timeout)
+        sent = self.request.sendfile(file)
+        if self.server.metrics is not None:
+            self.server.metrics.add_sent(sent)
+
+    def flush(self) -> None:
+        """Write out everything queued by send_lines()."""
+        if self._wbuf:
+            data = bytes(self._wbuf)
+            self._wbuf.clear()
+            self._send(data)
+
+    def _send(self, data: typing.Union[bytes, memoryview]) -> None:
+        self._settimeout(self.server.write_timeout)
+        if len(data) <= self.write_high_water:
+            self.request.sendall(data)
+        else:
+            # The timeout of sendall() covers the whole call, so large blocks
+            # are sent in chunks to time out only clients that stop reading.
+            view = memoryview(data)
+            step = self.write_high_water
+            for i in range(0, len(view), step):
+                self.request.sendall(view[i : i + step])
+        if self.server.metrics is not None:
+            self.server.metrics.add_sent(len(data))
 
-        self.send_lines(["501 Syntax Error"])
-        return
+    def _has_pending_command(self) -> bool:
+        """Whether a complete command line has already been received."""
+        return self._buffer.find(b"\n", self._scan) != -1
 
-    def select_group(self, group_name: str) -> bool:
-        self.server.refresh()
-        print("Group name", group_name)
-        if group_name in self.server.groups:
-            self.current_selected_newsgroup = group_name
-            group = self.server.groups[group_name]
-            if group.number == 0:
-                self.current_article_number = None
-            else:
-                self.current_article_number = group.low
-            self.send_lines(
-                [f"211 {group.number} {group.low} {group.high} {group.name}"]
-            )
-            return True
-        self.send_lines(["411 No such newsgroup"])
-        return False
+    def _find_line(
+        self, maxline: int = _MAXLINE
+    ) -> typing.Optional[typing.Tuple[int, int]]:
+        """Consume the next received line and return its [start, end) span in
+        self._buffer without the line terminator, or None if no complete line
+        has been received. The span is valid until the next _fill()."""
+        buffer = self._buffer
+        end = buffer.find(b"\n", self._scan)
+        if end == -1:
+            self._scan = len(buffer)
+            if self._scan - self._rpos > maxline:
+                raise NNTPDataError("Too big a line.")
+            return None
+        start = self._rpos
+        self._rpos = self._scan = end + 1
+        if end > start and buffer[end - 1] == 13:  # b"\r"
+            end -= 1
+        return start, end
 
-    def send_lines(self, lines: typing.List[str]) -> None:
-        for line in lines:
-            if self.server.debugging:
-                print("sending", line)
-            self.request.sendall(bytes(line.strip(), "utf-8") + _CRLF)
-
-    def _getline(self, strip_crlf: bool = True) -> str:
-        line = None
-        if b"\n" in self._buffer:
-            line = self._buffer[: self._buffer.find(b"\n")]
-            self._buffer = self._buffer[len(line) + 1 :]
-        while not line:
-            chunk = self.request.recv(_MAXLINE + 1)
-            self._buffer += chunk
-            if b"\n" in chunk or not chunk.strip():
-                break
-        if b"\n" not in self._buffer and self._buffer:
-            raise NNTPDataError("Too big a line.")
-        if not line:
-            line = self._buffer[: self._buffer.find(b"\n")]
-            self._buffer = self._buffer[len(line) + 1 :]
-        if line is None:
+    def _compact(self) -> None:
+        """Drop consumed bytes from the front of the receive buffer."""
+        if self._rpos == len(self._buffer):
+            self._buffer.clear()
+        elif self._rpos > len(self._buffer) // 2:
+            del self._buffer[: self._rpos]
+        else:
+            return
+        self._scan -= self._rpos
+        self._rpos = 0
+
+    def _fill(self) -> None:
+        """Receive more bytes from the client, raising EOFError on EOF."""
+        # The client may be waiting on a response before sending more.
+        self.flush()
+        self._compact()
+        self._settimeout(self._read_timeout())
+        try:
+            # recv() returns a bytes object of the received size, so idle
+            # connections keep no read buffer of their own.
+            received = self.request.recv(_READ_SIZE)
+        except socket.timeout:
+            raise NNTPTimeoutError()
+        if not received:
             raise EOFError
-        if strip_crlf:
-            if line[-2:] == _CRLF:
-                line = line[:-2]
-            elif line[-1:] in _CRLF:
-                line = line[:-1]
-        return line.decode("utf-8")
+        if self.server.metrics is not None:
+            self.server.metrics.add_received(len(received))
+        self._buffer += received
+
+    def _next_line(self, maxline: int = _MAXLINE) -> typing.Tuple[int, int]:
+        while True:
+            span = self._find_line(maxline)
+            if span is not None:
+                return span
+            self._fill()
+
+    def _getline(self) -> str:
+        start, end = self._next_line()
+        return self._buffer[start:end].decode("utf-8")
 
     def _getlines(self) -> str:
-        lines = []
+        """Read a dot-terminated block, e.g. a POST article, and return it
+        unstuffed with "\\n" line endings."""
+        article = bytearray()
+        buffer = self._buffer
         while True:
-            line = self._getline()
-            if line == ".":
+            start, end = self._next_line()
+            if end - start == 1 and buffer[start] == 46:  # b"."
                 break
-            if line.startswith(".."):
-                line = line[1:]
-            lines.append(line)
-        return "\n".join(lines)
+            if buffer.startswith(b"..", start, end):
+                start += 1
+            article += buffer[start:end]
+            article += b"\n"
+        del article[-1:]
+        return article.decode("utf-8")
 
     def hdr(self) -> None:
-        def get_value(i: ArticleInfo, field: str) -> str:
-            field = field.casefold()
-            if field == "subject":
-                value = articleinfo.subject
-            elif field == "from":
-                value = articleinfo.from_
-            elif field == "date":
-                value = email.utils.format_datetime(articleinfo.date)
-            elif field == "message-id":
-                value = articleinfo.message_id
-            elif field == "references":
-                value = articleinfo.references
-            elif field == ":bytes":
-                value = str(articleinfo.bytes)
-            elif field == ":lines":
-                value = str(articleinfo.lines)
-            else:
-                value = ""
-                for k, v in articleinfo.headers.items():
-                    if k.casefold() == field:
-                        value = v
-                        break
-            value = value.replace("\r\n", "").replace("\t", " ")
-            return value
-
         command, *tokens = self.data.strip().split()
 
         if len(tokens) == 0:
             self.send_lines(["501 Syntax Error"])
             return
+        get_value = header_accessor(tokens[0])
 
         if len(tokens) == 2:
             range_ = parse_range(tokens[1])
             if not range_:
                 # First form (message-id specified)
                 try:
-                    articleinfo = self.server.articles[tokens[1]]
-                    value = get_value(articleinfo, tokens[0])
-                    self.send_lines(
-                        [
-                            "225 Headers follow(multi-line)",
-                            f"{articleinfo.number} {value}",
-                            ".",
-                        ]
+                    articleinfo = self._articleinfo_by_id(tokens[1])
+                    value = get_value(articleinfo)
+                    self.send_multiline(
+                        "225 Headers follow(multi-line)",
+                        [f"{articleinfo.number} {value}"],
                     )
                 except NNTPArticleNotFound:
                     self.send_lines(["430 No article with that message-id"])
@@ -783,26 +3046,44 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                     self.send_lines(["412 No newsgroup selected"])
                     return
                 # Second form (range specified)
+                group = self.server.groups[
+                    typing.cast(str, self.current_selected_newsgroup)
+                ]
                 if not range_[1]:
-                    group = self.server.groups[
-                        typing.cast(str, self.current_selected_newsgroup)
-                    ]
                     range_ = (range_[0], group.high)
-                ret = []
-                for i in range(range_[0], typing.cast(int, range_[1]) + 1):
-                    try:
-                        articleinfo = self.server.articles[i]
-                        value = get_value(articleinfo, tokens[0])
-                        ret.append((articleinfo.number, value))
-                    except NNTPArticleNotFound:
-                        pass
-                if len(ret) == 0:
+                low, high = range_[0], typing.cast(int, range_[1])
+                overview = self._overview_file()
+                if overview is not None:
+                    values = overview.header(low, high, tokens[0])
+                    first_value = next(values, None)
+                    if first_value is None:
+                        self.send_lines(["423 No articles in that range"])
+                        return
+                    self.send_multiline(
+                        "225 Headers follow(multi-line)",
+                        (
+                            (b"%d %s" % item).strip() + _CRLF
+                            for item in itertools.chain([first_value], values)
+                        ),
+                    )
+                    return
+                column = self._resolve(
+                    self.server.hdr_range(group, low, high, tokens[0])
+                )
+                ret: typing.Iterator[str]
+                if column is not None:
+                    ret = (f"{number} {value}" for number, value in column)
+                else:
+                    ret = (
+                        f"{articleinfo.number} {get_value(articleinfo)}"
+                        for articleinfo in self._articles_in_range(low, high)
+                    )
+                first = next(ret, None)
+                if first is None:
                     self.send_lines(["423 No articles in that range"])
                     return
-                self.send_lines(
-                    ["225 Headers follow(multi-line)"]
-                    + [f"{number} {value}" for (number, value) in ret]
-                    + ["."]
+                self.send_multiline(
+                    "225 Headers follow(multi-line)", itertools.chain([first], ret)
                 )
                 return
             return
@@ -819,10 +3100,10 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             self.send_lines(["420 Current article number is invalid"])
             return
 
-        value = get_value(articleinfo, tokens[0])
+        value = get_value(articleinfo)
 
-        self.send_lines(
-            ["225 Headers follow(multi-line)", f"{articleinfo.number} {value}", "."]
+        self.send_multiline(
+            "225 Headers follow(multi-line)", [f"{articleinfo.number} {value}"]
         )
 
     def overview(self) -> None:
@@ -837,20 +3118,29 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                 if not range_[1]:
                     group = self.server.groups[self.current_selected_newsgroup]
                     range_ = (range_[0], group.high)
-                self.send_lines(["224 Overview information follows (multi-line)"])
-                for i in range(range_[0], typing.cast(int, range_[1]) + 1):
-                    try:
-                        self.send_lines([str(self.server.articles[i])])
-                    except NNTPArticleNotFound:
-                        pass
-                self.send_lines(["."])
+                overview = self._overview_file()
+                if overview is not None:
+                    self.send_lines(["224 Overview information follows (multi-line)"])
+                    self._write(
+                        overview.overview(range_[0], typing.cast(int, range_[1]))
+                    )
+                    self.send_lines(["."])
+                    return
+                self.send_multiline(
+                    "224 Overview information follows (multi-line)",
+                    map(
+                        self.server.overview_line,
+                        self._articles_in_range(
+                            range_[0], typing.cast(int, range_[1])
+                        ),
+                    ),
+                )
                 return
             try:
-                article = self.server.articles[tokens[0]]
-                self.send_lines(
-                    ["224 Overview information follows (multi-line)"]
-                    + list(map(str, [article]))
-                    + ["."]
+                article = self._articleinfo_by_id(tokens[0])
+                self.send_multiline(
+                    "224 Overview information follows (multi-line)",
+                    [self.server.overview_line(article)],
                 )
             except NNTPArticleNotFound:
                 self.send_lines(["430 No article with that message-id"])
@@ -864,17 +3154,16 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             return
         try:
             article = self.server.articles[self.current_article_number]
-            self.send_lines(
-                ["224 Overview information follows (multi-line)"]
-                + list(map(str, [article]))
-                + ["."]
+            self.send_multiline(
+                "224 Overview information follows (multi-line)",
+                [self.server.overview_line(article)],
             )
         except NNTPArticleNotFound:
             self.send_lines(["420 Current article number is invalid"])
         return
 
     def stat(self) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.split()
         if len(tokens) == 0:
             if self.current_selected_newsgroup is None:
@@ -888,6 +3177,12 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             except NNTPArticleNotFound:
                 self.send_lines(["420 Current article number is invalid"])
                 return
+        elif tokens[0].startswith("<"):
+            try:
+                article = self._articleinfo_by_id(tokens[0])
+            except NNTPArticleNotFound:
+                self.send_lines(["430 No article with that message-id"])
+                return
         else:
             try:
                 number = int(tokens[0])
@@ -902,12 +3197,14 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
             except NNTPArticleNotFound:
                 self.send_lines(["423 No article with that number"])
                 return
+            if self.current_selected_newsgroup is not None:
+                self.current_article_number = number
 
         self.send_lines([f"223 {article.number} {article.message_id}"])
         return
 
     def article(self, body: bool = False) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.split()
         if len(tokens) == 0:
             if self.current_selected_newsgroup is None:
@@ -917,7 +3214,9 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                 self.send_lines(["420 Current article number is invalid"])
                 return
             try:
-                article = self.server.article(self.current_article_number)
+                article = self._resolve(
+                    self.server.article(self.current_article_number)
+                )
             except NNTPArticleNotFound:
                 self.send_lines(["420 Current article number is invalid"])
                 return
@@ -928,38 +3227,44 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                     if number == 0:
                         self.send_lines(["423 No article with that number"])
                         return
-                    article = self.server.article(number)
+                    article = self._resolve(self.server.article(number))
+                    if self.current_selected_newsgroup is not None:
+                        self.current_article_number = number
                 except ValueError:
-                    article = self.server.article(tokens[0])
+                    article = self._article_by_id(tokens[0])
             except NNTPArticleNotFound:
                 self.send_lines(["423 No article with that number"])
                 return
 
         if body:
-            ret = [f"222 {article.info.number} {article.info.message_id}"]
+            self.send_lines([f"222 {article.info.number} {article.info.message_id}"])
         else:
-            ret = [
-                f"220 {article.info.number} {article.info.message_id}",
-                f"From: <{article.info.from_}>",
-                f"Subject: {article.info.subject}",
-                f"Date: {email.utils.format_datetime(article.info.date)}",
-                f"Message-ID: {article.info.message_id}",
-            ]
-            if article.info.references:
-                ret.append(f"References: {article.info.references}")
-            ret += [f"{k}: {v}" for k, v in article.info.headers.items()]
-
-            ret.append("")
-        for line in article.body.split("\n"):
-            if line.startswith("."):
-                ret.append(f".{line}")
-                continue
-            ret.append(line)
-        ret += ["."]
-        self.send_lines(ret)
+            self.send_lines(
+                [f"220 {article.info.number} {article.info.message_id}"]
+                + [_dot_stuff(line) for line in self._header_lines(article.info)]
+                + [""]
+            )
+        spool = self._resolve(self.server.article_spool(article))
+        if spool is not None:
+            with spool:
+                self.flush()
+                self._sendfile(spool)
+        else:
+            self._write(self.server.body_wire(article))
+        self.send_lines(["."])
+
+    def _header_lines(self, info: ArticleInfo) -> typing.Iterator[str]:
+        yield f"From: <{info.from_}>"
+        yield f"Subject: {info.subject}"
+        yield f"Date: {email.utils.format_datetime(info.date)}"
+        yield f"Message-ID: {info.message_id}"
+        if info.references:
+            yield f"References: {info.references}"
+        for k, v in info.headers.items():
+            yield f"{k}: {v}"
 
     def head(self) -> None:
-        self.server.refresh()
+        self.server.refresh_scheduler.request(self._resolve)
         command, *tokens = self.data.split()
         if len(tokens) == 0:
             if self.current_selected_newsgroup is None:
@@ -969,7 +3274,9 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                 self.send_lines(["420 Current article number is invalid"])
                 return
             try:
-                article = self.server.article(self.current_article_number)
+                article = self._resolve(
+                    self.server.article(self.current_article_number)
+                )
             except NNTPArticleNotFound:
                 self.send_lines(["420 Current article number is invalid"])
                 return
@@ -980,25 +3287,19 @@ class NNTPConnectionHandler(socketserver.BaseRequestHandler):
                     if number == 0:
                         self.send_lines(["423 No article with that number"])
                         return
-                    article = self.server.article(number)
+                    article = self._resolve(self.server.article(number))
+                    if self.current_selected_newsgroup is not None:
+                        self.current_article_number = number
                 except ValueError:
-                    article = self.server.article(tokens[0])
+                    article = self._article_by_id(tokens[0])
             except NNTPArticleNotFound:
                 self.send_lines(["423 No article with that number"])
                 return
 
-        ret = [
+        self.send_multiline(
             f"221 {article.info.number} {article.info.message_id}",
-            f"From: <{article.info.from_}>",
-            f"Subject: {article.info.subject}",
-            f"Date: {email.utils.format_datetime(article.info.date)}",
-            f"Message-ID: {article.info.message_id}",
-        ]
-        if article.info.references:
-            ret.append(f"References: {article.info.references}")
-        ret += [f"{k}: {v}" for k, v in article.info.headers.items()]
-        ret += ["."]
-        self.send_lines(ret)
+            self._header_lines(article.info),
+        )
 
     def help(self) -> None:
         import textwrap
@@ -1025,4 +3326,870 @@ You can submit an article by issuing `POST` and the article content with each li
 
 You can authenticate by issuing `AUTHINFO USER ` followed by your username and then `AUTHINFO PASS ` followed by your password."""
 
-        self.send_lines(["100 Help text follows"] + wrapper.wrap(server_help) + ["."])
+        self.send_multiline("100 Help text follows", wrapper.wrap(server_help))
+
+
+class AsyncNNTPConnectionHandler(NNTPConnectionHandler):
+    """
+    Connection handler for AsyncNNTPServer.
+
+    Idle connections only cost a coroutine and a pair of asyncio streams. Each
+    command line is executed by the regular NNTPConnectionHandler command
+    methods in the server's executor, so synchronous backends never block the
+    event loop, while coroutine backend hooks are awaited on the loop.
+    """
+
+    server: "AsyncNNTPServer"  # type: ignore[assignment]
+
+    def __init__(
+        self,
+        server: "AsyncNNTPServer",
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        # BaseRequestHandler.__init__ would run handle() synchronously, so
+        # only the connection state is initialized here.
+        self._init_state()
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.request = writer.get_extra_info("socket")
+        self.client_address = writer.get_extra_info("peername")
+        self._tls = writer.get_extra_info("sslcontext") is not None
+        _logger.info("New connection from %s.", self.client_address)
+        self.loop = asyncio.get_running_loop()
+
+    def _starttls_available(self) -> bool:
+        # StreamWriter.start_tls() is available from Python 3.11.
+        return hasattr(self.writer, "start_tls") and super()._starttls_available()
+
+    def _start_tls(self, context: "ssl.SSLContext") -> None:
+        asyncio.run_coroutine_threadsafe(self._astart_tls(context), self.loop).result()
+        self.request = self.writer.get_extra_info("socket")
+
+    async def _astart_tls(self, context: "ssl.SSLContext") -> None:
+        # Stop reading before the 382 response goes out, or the client's
+        # handshake may be buffered by the StreamReader as NNTP data.
+        typing.cast(asyncio.Transport, self.writer.transport).pause_reading()
+        # Drop unprotected data the client sent after STARTTLS.
+        self.reader._buffer.clear()  # type: ignore[attr-defined]
+        self.flush()
+        await self.writer.start_tls(  # type: ignore[attr-defined]
+            context, ssl_handshake_timeout=self.server.handshake_timeout
+        )
+
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _resolve(self, value: typing.Any) -> typing.Any:
+        if inspect.isawaitable(value):
+            return asyncio.run_coroutine_threadsafe(
+                typing.cast(typing.Coroutine[typing.Any, typing.Any, typing.Any], value),
+                self.loop,
+            ).result()
+        return value
+
+    def _send(self, data: typing.Union[bytes, memoryview]) -> None:
+        if self._in_loop():
+            self.writer.write(data)
+        else:
+            # Waiting for the transport to drain keeps large responses from
+            # piling up in memory when the client reads slowly.
+            asyncio.run_coroutine_threadsafe(self._awrite(data), self.loop).result()
+        if self.server.metrics is not None:
+            self.server.metrics.add_sent(len(data))
+
+    async def _awrite(self, data: typing.Union[bytes, memoryview]) -> None:
+        # As in NNTPConnectionHandler._send(), write_timeout applies to each
+        # chunk of a large block rather than to the whole block.
+        view = memoryview(data)
+        step = self.write_high_water
+        for i in range(0, len(view), step):
+            self.writer.write(view[i : i + step])
+            await self._drain()
+
+    async def _drain(self) -> None:
+        if self.writer.transport.get_write_buffer_size() == 0:
+            # Nothing to wait for; skip the cost of a timeout.
+            await self.writer.drain()
+            return
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.server.write_timeout)
+        except asyncio.TimeoutError:
+            # Nothing more can be sent, so do not wait for the buffer to be
+            # flushed on close either.
+            self.writer.transport.abort()
+            raise
+
+    async def _afill(self) -> None:
+        self._compact()
+        try:
+            chunk = await asyncio.wait_for(
+                self.reader.read(_READ_SIZE), self._read_timeout()
+            )
+        except asyncio.TimeoutError:
+            raise NNTPTimeoutError()
+        if not chunk:
+            raise EOFError
+        if self.server.metrics is not None:
+            self.server.metrics.add_received(len(chunk))
+        self._buffer += chunk
+
+    async def _agetline(self) -> str:
+        while True:
+            span = self._find_line()
+            if span is not None:
+                return self._buffer[span[0] : span[1]].decode("utf-8")
+            await self._afill()
+
+    def _sendfile(self, file: typing.BinaryIO) -> None:
+        # Called from executor threads after flush(), so previously queued
+        # writes are already scheduled on the loop.
+        sent = asyncio.run_coroutine_threadsafe(
+            self.loop.sendfile(self.writer.transport, file), self.loop
+        ).result()
+        if self.server.metrics is not None:
+            self.server.metrics.add_sent(sent)
+
+    def _fill(self) -> None:
+        # Called from executor threads (e.g. while reading a POST body).
+        self.flush()
+        asyncio.run_coroutine_threadsafe(self._afill(), self.loop).result()
+
+    def _process_pipeline(self) -> None:
+        """Process self.data and every further command that has already been
+        received, in one executor call."""
+        while True:
+            self.process_command()
+            if self._quit or not self._has_pending_command():
+                return
+            self.data = self._getline()
+
+    async def run(self) -> None:
+        if self.server.metrics is not None:
+            self.server.metrics.connection_opened()
+        try:
+            self.greet()
+            self._init = False
+            self.flush()
+            await self._drain()
+            while not self._quit:
+                try:
+                    self._idle = True
+                    self.data = await self._agetline()
+                    self._idle = False
+                except NNTPDataError as exc:
+                    _logger.warning("Data error from %s: %s", self.client_address, exc)
+                    self._quit = True
+                    self.send_lines(["205 Connection closing"])
+                    break
+                except EOFError:
+                    break
+                await self.loop.run_in_executor(
+                    self.server.executor, self._process_pipeline
+                )
+                self.flush()
+                await self._drain()
+            self.flush()
+            await self._drain()
+        except (ConnectionError, EOFError):
+            pass
+        except NNTPTimeoutError as exc:
+            self._timed_out(exc)
+        except asyncio.TimeoutError:
+            _logger.info("Write timeout, dropping %s.", self.client_address)
+        finally:
+            if self.server.metrics is not None:
+                self.server.metrics.connection_closed()
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class AsyncNNTPServer(NNTPBackend):
+    """
+    An asyncio based NNTP server.
+
+    Backends implement the same NNTPBackend contract as for NNTPServer; any of
+    the hooks called per command (refresh, article, newnews, newgroups, post,
+    auth_user) may additionally be defined with `async def`.
+
+    A backend written once as an NNTPBackend subclass can be served by both:
+
+        class ThreadedServer(MyBackend, NNTPServer): ...
+        class AsyncServer(MyBackend, AsyncNNTPServer): ...
+
+        AsyncServer(("localhost", 119)).run()
+    """
+
+    request_queue_size: int = 1024
+    allow_reuse_address: bool = True
+
+    def __init__(
+        self,
+        server_address: typing.Tuple[str, int],
+        RequestHandlerClass: typing.Type[
+            AsyncNNTPConnectionHandler
+        ] = AsyncNNTPConnectionHandler,
+        *args: typing.Any,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        # None uses the event loop's default ThreadPoolExecutor, which bounds
+        # the number of threads regardless of the number of connections.
+        self.executor = executor
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+        super().__init__(*args, **kwargs)
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Bind the listening socket and start accepting connections."""
+        host, port = self.server_address[:2]
+        tls: typing.Dict[str, typing.Any] = {}
+        if self.use_ssl and self.ssl_context is not None:
+            # The event loop does the handshakes without blocking.
+            tls = {
+                "ssl": self.ssl_context,
+                "ssl_handshake_timeout": self.handshake_timeout,
+            }
+        self._server = await asyncio.start_server(
+            self._client_connected,
+            host,
+            port,
+            backlog=self.request_queue_size,
+            reuse_address=self.allow_reuse_address,
+            **tls,
+        )
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+        loop = asyncio.get_running_loop()
+
+        def resolve(value: typing.Any) -> typing.Any:
+            if inspect.isawaitable(value):
+                return asyncio.run_coroutine_threadsafe(
+                    typing.cast(
+                        typing.Coroutine[typing.Any, typing.Any, typing.Any], value
+                    ),
+                    loop,
+                ).result()
+            return value
+
+        self.refresh_scheduler.start(resolve)
+        self.start_warm_up(resolve)
+        self.start_metrics_export()
+        self._install_sighup()
+        return self._server
+
+    async def _client_connected(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        client_address = writer.get_extra_info("peername")
+        refusal = self.admit(client_address)
+        if refusal is not None:
+            writer.write(refusal)
+            writer.close()
+            return
+        try:
+            handler = self.RequestHandlerClass(self, reader, writer)
+            await handler.run()
+        finally:
+            self.connection_limiter.release(_address_key(client_address))
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        server = typing.cast(asyncio.AbstractServer, self._server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self._uninstall_sighup()
+        self.refresh_scheduler.stop()
+        self.stop_metrics_export()
+        if self._server is not None:
+            self._server.close()
+
+    def run(self) -> None:
+        """Run the server in a new event loop until interrupted."""
+        asyncio.run(self.serve_forever())
+
+
+class PooledNNTPConnectionHandler(NNTPConnectionHandler):
+    """
+    Connection handler for PooledNNTPServer.
+
+    Instead of owning a thread for the lifetime of the connection, the
+    handler is called by a pool worker whenever its socket becomes readable,
+    executes the commands received so far and returns.
+    """
+
+    server: "PooledNNTPServer"  # type: ignore[assignment]
+
+    def __init__(
+        self,
+        request: typing.Any,
+        client_address: typing.Any,
+        server: "PooledNNTPServer",
+    ) -> None:
+        # BaseRequestHandler.__init__ would run handle() synchronously, so
+        # only the connection state is initialized here.
+        self._init_state()
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        # time.monotonic() of the last time the connection was handed back to
+        # the selector, for idle and command timeouts
+        self.waiting_since = 0.0
+        # Selector events to wait for
+        self.events = selectors.EVENT_READ
+        # Command waiting for the rest of its data block (see
+        # _block_received()), and the number of bytes of the block searched
+        self._deferred: typing.Optional[typing.Callable[[], None]] = None
+        self._block_scanned = 0
+
+    def start(self) -> bool:
+        """Start the TLS handshake, if any, or greet the client. Returns
+        whether the connection is still open."""
+        self.setup()
+        if _is_tls_socket(self.request):
+            self._settimeout(0.0)
+            return self._continue_handshake()
+        return self._greet()
+
+    def _greet(self) -> bool:
+        self.greet()
+        self._init = False
+        try:
+            self.flush()
+        except OSError:
+            return False
+        return True
+
+    def _continue_handshake(self) -> bool:
+        """Advance the TLS handshake as far as possible without blocking, so
+        that slow clients do not hold a worker."""
+        try:
+            self.request.do_handshake()
+        except ssl.SSLWantReadError:
+            self.events = selectors.EVENT_READ
+            return True
+        except ssl.SSLWantWriteError:
+            self.events = selectors.EVENT_WRITE
+            return True
+        except (OSError, ValueError) as exc:
+            _logger.info("TLS handshake with %s failed: %s", self.client_address, exc)
+            return False
+        self._tls = True
+        self.events = selectors.EVENT_READ
+        if self._upgraded:
+            # Upgraded with STARTTLS: the client waits for its next response.
+            self._init = False
+            return True
+        return self._greet()
+
+    def _start_tls(self, context: "ssl.SSLContext") -> None:
+        """Send the queued 382 response and start the TLS handshake, which
+        _continue_handshake() advances whenever the socket is ready."""
+        self.flush()
+        self._settimeout(0.0)
+        self.request = context.wrap_socket(
+            self.request, server_side=True, do_handshake_on_connect=False
+        )
+        self._init = True
+
+    def serve_ready(self) -> bool:
+        """Receive what the client sent and execute every complete command.
+
+        The socket is only read as far as data is available, so a client
+        that sends part of a command, TLS record or POST article does not
+        hold the worker; expired() enforces the timeouts instead.
+
+        Returns whether the connection is still open."""
+        if self._init:
+            return self._continue_handshake()
+        try:
+            if not self._receive():
+                return True
+            # _init is set again by STARTTLS until the handshake completes.
+            while not self._quit and not self._init:
+                if self._deferred is not None:
+                    if self._block_received():
+                        deferred, self._deferred = self._deferred, None
+                        deferred()
+                        continue
+                elif self._has_pending_command():
+                    self.data = self._getline()
+                    self.process_command()
+                    continue
+                elif self._rpos < len(self._buffer):
+                    # Reject an overlong partial line now rather than after
+                    # it has been received completely
+                    self._find_line()
+                # TLS sockets may hold decrypted data that the selector will
+                # not report.
+                pending = getattr(self.request, "pending", None)
+                if pending is None or not pending() or not self._receive():
+                    break
+            self.flush()
+        except EOFError:
+            return False
+        except NNTPDataError as exc:
+            _logger.warning("Data error from %s: %s", self.client_address, exc)
+            self._quit = True
+            self.send_lines(["205 Connection closing"])
+            try:
+                self.flush()
+            except OSError:
+                pass
+        except socket.timeout:
+            _logger.info("Write timeout, dropping %s.", self.client_address)
+            return False
+        except OSError as exc:
+            _logger.info("Connection error from %s: %s", self.client_address, exc)
+            return False
+        return not self._quit
+
+    def _receive(self) -> bool:
+        """Receive the bytes that are available without blocking. Returns
+        whether any were received, and raises EOFError on EOF."""
+        self._compact()
+        self._settimeout(0.0)
+        try:
+            received = self.request.recv(_READ_SIZE)
+        except ssl.SSLWantWriteError:
+            self.events = selectors.EVENT_WRITE
+            return False
+        except (BlockingIOError, ssl.SSLWantReadError):
+            self.events = selectors.EVENT_READ
+            return False
+        self.events = selectors.EVENT_READ
+        if not received:
+            raise EOFError
+        if self.server.metrics is not None:
+            self.server.metrics.add_received(len(received))
+        self._buffer += received
+        return True
+
+    def _block_received(self) -> bool:
+        """Whether the multi-line data block starting at the read position,
+        e.g. a POST article, has been received up to its "." line."""
+        buffer = self._buffer
+        start = self._rpos + self._block_scanned
+        if _BLOCK_END.search(buffer, start) is not None:
+            return True
+        # The terminating line may be split, so its start is searched again.
+        self._block_scanned = max(len(buffer) - 3 - self._rpos, 0)
+        if len(buffer) - buffer.rfind(b"\n", self._rpos) - 1 > _MAXLINE:
+            raise NNTPDataError("Too big a line.")
+        return False
+
+    def _post_article(self) -> None:
+        # Wait for the whole article in the selector instead of in _fill().
+        if self._block_received():
+            self._block_scanned = 0
+            super()._post_article()
+        else:
+            self._deferred = self._post_article
+
+    def expired(self, now: float) -> bool:
+        """Whether the client has been silent for longer than the idle,
+        command or handshake timeout while waiting in the selector."""
+        if self._init:
+            timeout = self.server.handshake_timeout
+        else:
+            self._idle = self._deferred is None
+            timeout = self._read_timeout()
+        return timeout is not None and now - self.waiting_since > timeout
+
+
+class PooledNNTPServer(NNTPServer):
+    """
+    A server with a fixed pool of worker threads.
+
+    A single thread waits with a selector for new connections and for
+    connections with input. A connection is handed to the pool only while its
+    commands are being executed, so thousands of mostly idle newsreader
+    connections share `workers` threads, while slow backend calls still run
+    concurrently in different workers.
+
+        class PooledServer(MyBackend, PooledNNTPServer): ...
+
+        with PooledServer(("localhost", 119)) as server:
+            server.serve_forever()
+    """
+
+    # Number of worker threads executing commands
+    workers: int = 16
+
+    def __init__(
+        self,
+        server_address: typing.Tuple[str, int],
+        RequestHandlerClass: typing.Type[
+            PooledNNTPConnectionHandler
+        ] = PooledNNTPConnectionHandler,
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            self.workers, thread_name_prefix="nntp-worker"
+        )
+        self._selector = selectors.DefaultSelector()
+        # Connections to register with the selector, queued by workers and
+        # picked up by the selector thread after a wake-up byte
+        self._returning: "queue.SimpleQueue[PooledNNTPConnectionHandler]" = (
+            queue.SimpleQueue()
+        )
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._connections: typing.Set[PooledNNTPConnectionHandler] = set()
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()
+        self._stopped.set()
+        # Set by server_close() once open connections are no longer served
+        self._closing = False
+        super().__init__(server_address, RequestHandlerClass, *args, **kwargs)
+
+    def process_request(self, request: typing.Any, client_address: typing.Any) -> None:
+        refusal = self.admit(client_address)
+        if refusal is not None:
+            if not _is_tls_socket(request):
+                try:
+                    request.settimeout(1.0)
+                    request.sendall(refusal)
+                except OSError:
+                    pass
+            self.shutdown_request(request)
+            return
+        handler_class = typing.cast(
+            typing.Type[PooledNNTPConnectionHandler], self.RequestHandlerClass
+        )
+        handler = handler_class(request, client_address, self)
+        self._connections.add(handler)
+        self.executor.submit(self._run, handler, handler.start)
+
+    def _run(
+        self,
+        handler: PooledNNTPConnectionHandler,
+        step: typing.Callable[[], bool],
+    ) -> None:
+        """Run step in a worker, then return the connection to the selector
+        or close it."""
+        try:
+            alive = step()
+        except Exception:
+            _logger.exception("Error serving %s", handler.client_address)
+            alive = False
+        if alive and not self._closing:
+            handler.waiting_since = time.monotonic()
+            self._returning.put(handler)
+            try:
+                self._wakeup_w.send(b"\0")
+            except BlockingIOError:
+                # A wake-up is already pending.
+                pass
+        else:
+            self._close(handler)
+
+    def _expire(self, handler: PooledNNTPConnectionHandler) -> bool:
+        handler._timed_out(NNTPTimeoutError())
+        return False
+
+    def _close(self, handler: PooledNNTPConnectionHandler) -> None:
+        if handler not in self._connections:
+            return
+        self._connections.discard(handler)
+        try:
+            handler.finish()
+        finally:
+            self.shutdown_request(handler.request)
+            self.connection_limiter.release(_address_key(handler.client_address))
+
+    def _accept(self) -> None:
+        """Accept a connection, as BaseServer._handle_request_noblock()
+        (which is private) does."""
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            return
+        if not self.verify_request(request, client_address):
+            self.shutdown_request(request)
+            return
+        try:
+            self.process_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+        except:
+            self.shutdown_request(request)
+            raise
+
+    def _poll(self, timeout: float) -> None:
+        """Wait up to timeout seconds for events and dispatch them."""
+        selector = self._selector
+        for key, _events in selector.select(timeout):
+            if key.fileobj is self.socket:
+                self._accept()
+            elif key.fileobj is self._wakeup_r:
+                try:
+                    self._wakeup_r.recv(4096)
+                except BlockingIOError:
+                    pass
+            else:
+                handler = key.data
+                selector.unregister(key.fileobj)
+                self.executor.submit(self._run, handler, handler.serve_ready)
+        while True:
+            try:
+                handler = self._returning.get_nowait()
+            except queue.Empty:
+                break
+            selector.register(handler.request, handler.events, handler)
+        if (
+            self.idle_timeout is not None
+            or self.command_timeout is not None
+            or self.handshake_timeout is not None
+        ):
+            now = time.monotonic()
+            for key in list(selector.get_map().values()):
+                handler = key.data
+                if handler is not None and handler.expired(now):
+                    selector.unregister(key.fileobj)
+                    expire = functools.partial(self._expire, handler)
+                    self.executor.submit(self._run, handler, expire)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self._stopping.clear()
+        self._stopped.clear()
+        self.refresh_scheduler.start()
+        self.start_warm_up()
+        self.start_metrics_export()
+        self._install_sighup()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while not self._stopping.is_set():
+                self._poll(poll_interval)
+                self.service_actions()
+        finally:
+            self._selector.unregister(self.socket)
+            self._uninstall_sighup()
+            self.refresh_scheduler.stop()
+            self.stop_metrics_export()
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """Stop serve_forever() and wait until it returns."""
+        self._stopping.set()
+        try:
+            self._wakeup_w.send(b"\0")
+        except BlockingIOError:
+            pass
+        self._stopped.wait()
+
+    def server_close(self) -> None:
+        """Stop listening and, if block_on_close is set, keep serving the open
+        connections until their clients quit, as ThreadingMixIn does."""
+        super().server_close()
+        if self.block_on_close:
+            while self._connections:
+                self._poll(0.5)
+        self._closing = True
+        self.executor.shutdown(wait=True)
+        for handler in list(self._connections):
+            self._close(handler)
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+
+class PreforkLauncher:
+    """
+    Runs a server in several forked worker processes sharing one listening
+    address, so that formatting and backend work use more than one core.
+
+    server_class is an NNTPServer or PooledNNTPServer subclass; every worker
+    creates its own instance with server_class(server_address, *args,
+    **kwargs) after the fork. By default the parent binds the listening
+    socket once and the workers inherit it; with reuse_port set, every worker
+    binds its own SO_REUSEPORT socket instead and the kernel balances new
+    connections between them (Linux, BSD).
+
+    Data the workers only read (indexes, ArticleStore columns, caches) should
+    be loaded before run(), e.g. in module or class attributes: forked workers
+    then share its memory pages copy-on-write. run() calls gc.freeze() before
+    forking so that garbage collection does not copy those pages. Array-based
+    structures (ArticleNumberIndex, ArticleStore) and mmap-based ones
+    (OverviewDatabase) stay shared best, because reading them does not update
+    reference counts of per-article objects.
+
+    SIGHUP starts a new set of workers, then asks the old ones to stop
+    gracefully; SIGTERM and SIGINT stop all workers. A worker asked to stop
+    closes its listening socket, finishes the connections it is serving and
+    exits, or is killed after graceful_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        server_class: typing.Type[NNTPServer],
+        server_address: typing.Tuple[str, int],
+        *args: typing.Any,
+        processes: typing.Optional[int] = None,
+        reuse_port: bool = False,
+        graceful_timeout: float = 30.0,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.server_class = server_class
+        self.server_address = server_address
+        self.args = args
+        self.kwargs = kwargs
+        self.processes = processes or os.cpu_count() or 1
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.socket: typing.Optional[socket.socket] = None
+        # Pids of the current workers, and of stopping workers with the time
+        # they get killed
+        self.workers: typing.Set[int] = set()
+        self._retiring: typing.Dict[int, float] = {}
+        self._reload = False
+        self._stop = False
+
+    def listen(self) -> socket.socket:
+        """Create a listening socket as server_class would."""
+        sock = socket.socket(self.server_class.address_family, socket.SOCK_STREAM)
+        if self.server_class.allow_reuse_address:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(self.server_address)
+        sock.listen(self.server_class.request_queue_size)
+        return sock
+
+    def reload(self) -> None:
+        """Replace the workers with new ones, as on SIGHUP."""
+        self._reload = True
+
+    def stop(self) -> None:
+        """Stop all workers and return from run(), as on SIGTERM."""
+        self._stop = True
+
+    def run(self) -> None:
+        """Fork the workers and supervise them until stop() is called."""
+        if not hasattr(os, "fork"):
+            raise NotImplementedError("PreforkLauncher requires os.fork()")
+        if not self.reuse_port:
+            self.socket = self.listen()
+            self.server_address = self.socket.getsockname()[:2]
+        previous = {
+            signum: signal.signal(signum, handler)
+            for signum, handler in (
+                (signal.SIGHUP, lambda signum, frame: self.reload()),
+                (signal.SIGTERM, lambda signum, frame: self.stop()),
+                (signal.SIGINT, lambda signum, frame: self.stop()),
+            )
+        }
+        gc.freeze()
+        try:
+            self._supervise()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            if self.socket is not None:
+                self.socket.close()
+
+    def _supervise(self) -> None:
+        while len(self.workers) < self.processes:
+            self._spawn()
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                _logger.info("Reloading %d workers.", self.processes)
+                old, self.workers = self.workers, set()
+                while len(self.workers) < self.processes:
+                    self._spawn()
+                self._retire(old)
+            for pid in self._reap():
+                if pid in self.workers:
+                    _logger.warning("Worker %d exited, replacing it.", pid)
+                    self.workers.discard(pid)
+                    self._spawn()
+            self._kill_overdue()
+            time.sleep(0.2)
+        self._retire(self.workers)
+        self.workers = set()
+        while self._retiring:
+            self._reap()
+            self._kill_overdue()
+            time.sleep(0.05)
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._worker()
+                status = 0
+            except BaseException:
+                _logger.exception("Worker %d failed", os.getpid())
+            finally:
+                os._exit(status)
+        self.workers.add(pid)
+
+    def _retire(self, pids: typing.Iterable[int]) -> None:
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self._retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self) -> typing.List[int]:
+        """Collect exited workers and return their pids."""
+        pids = []
+        while True:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self._retiring.pop(pid, None)
+            pids.append(pid)
+        return pids
+
+    def _kill_overdue(self) -> None:
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now > deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _worker(self) -> None:
+        """Serve connections in a forked worker until SIGTERM."""
+        sock = self.socket if self.socket is not None else self.listen()
+        server = self.server_class(
+            self.server_address, *self.args, bind_and_activate=False, **self.kwargs
+        )
+        server.socket.close()
+        server.socket = sock
+        server.server_address = sock.getsockname()
+
+        def stop(signum: int, frame: typing.Any) -> None:
+            # shutdown() waits for serve_forever(), which runs in this thread.
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
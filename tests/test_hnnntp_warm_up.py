@@ -0,0 +1,62 @@
+"""Commands must not wait for hnnntp's background warm_up() to finish."""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import typing
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "examples"))
+
+import hnnntp  # noqa: E402
+from nntpserver import NNTPConnectionHandler  # noqa: E402
+
+
+class BlockedWarmUpServer(hnnntp.HNNNTPServer):
+    """Does not load the index until warm_up_may_finish is set."""
+
+    refresh_in_background = False
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        self.warm_up_may_finish = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def debugging(self) -> bool:
+        return False
+
+    def warm_up(self) -> None:
+        self.warm_up_may_finish.wait()
+        super().warm_up()
+
+
+class WarmUpTest(unittest.TestCase):
+    def setUp(self) -> None:
+        cwd = os.getcwd()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, cwd)
+        get_to_json = hnnntp.get_to_json
+        hnnntp.get_to_json = lambda url: [3, 2, 1]
+        self.addCleanup(setattr, hnnntp, "get_to_json", get_to_json)
+
+    def test_group_during_warm_up(self) -> None:
+        server = BlockedWarmUpServer(("127.0.0.1", 0), NNTPConnectionHandler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.warm_up_may_finish.set)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        conn = socket.create_connection(server.server_address, timeout=2)
+        with conn, conn.makefile("rb") as replies:
+            replies.readline()
+            conn.sendall(b"GROUP hn.all\r\n")
+            self.assertEqual(replies.readline(), b"211 3 1 3 hn.all\r\n")
+            conn.sendall(b"QUIT\r\n")
+            replies.readline()
+        self.assertFalse(server.index.loaded.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()